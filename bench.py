@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Offline benchmark: replays synthetic or recorded traffic through on_message and
+# the command callbacks using stub Discord objects, one subprocess per table size
+# so peak RSS is measured per run.
+#
+#   python bench.py                               # 10, 1k, 100k, 1M users
+#   python bench.py --users 10,1000000 --rate 200
+#   python bench.py --replay traffic.jsonl --check
+#   python bench.py --save-baseline
+
+BASELINE_FILE = "bench_baselines.json"
+DEFAULT_USERS = "10,1000,100000,1000000"
+GUILD_ID = 1
+CHAT_CHANNEL_ID = 10
+P99_SLACK_MS = 0.05  # sub-0.1ms p99s jitter run to run; ignore regressions smaller than this
+
+CHAT_LINES = [
+    "anyone else still up?",
+    "that boss fight was brutal",
+    "the vampire lore in this game is wild",
+    "brb grabbing a snack",
+    "gameplay looks so smooth tonight",
+    "this soundtrack is giving me chills",
+    "fluff levels critical",
+    "lol",
+    "who else is watching the stream",
+    "blood moon tonight, spooky",
+]
+COMMAND_LINES = [
+    "!stats", "!leaderboard", "!leaderboard 2", "!rank", "!realmpath",
+    "!choose flame", "!hauntme", "!bloodwhisper", "!hauntstats", "!bloodstats",
+]
+QOTD_LINES = [
+    "QOTD: What's your haunting style?",
+    "Question of the day: If The Realm was a video game, what would it be?",
+    "QOTD: Which soundtrack lives rent free in your head?",
+]
+
+
+class FakeRole:
+    def __init__(self, role_id, name, guild):
+        self.id = role_id
+        self.name = name
+        self.guild = guild
+
+    def is_default(self):
+        return self.id == self.guild.id
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeMember:
+    def __init__(self, member_id, guild, bot=False):
+        self.id = member_id
+        self.guild = guild
+        self.bot = bot
+        self.name = self.display_name = f"dweller{member_id}"
+        self.mention = f"<@{member_id}>"
+        self._roles = {}
+
+    @property
+    def roles(self):
+        return [self.guild.default_role, *self._roles.values()]
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    async def add_roles(self, *roles, **kwargs):
+        self._roles.update((role.id, role) for role in roles)
+
+    async def remove_roles(self, *roles, **kwargs):
+        for role in roles:
+            self._roles.pop(role.id, None)
+
+    async def edit(self, roles=(), **kwargs):
+        self._roles = {role.id: role for role in roles}
+
+    async def send(self, content=None, **kwargs):
+        pass
+
+
+class FakeGuild:
+    def __init__(self, guild_id, role_names):
+        self.id = guild_id
+        self.default_role = FakeRole(guild_id, "@everyone", self)
+        self.roles = [self.default_role] + [FakeRole(100 + i, name, self) for i, name in enumerate(role_names)]
+        self.members = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    async def query_members(self, user_ids=None, limit=5, cache=True, **kwargs):
+        return [self.members[user_id] for user_id in user_ids or () if user_id in self.members]
+
+    def member(self, member_id, bot=False):
+        member = self.members.get(member_id)
+        if member is None:
+            member = self.members[member_id] = FakeMember(member_id, self, bot)
+        return member
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+class FakeContext:
+    def __init__(self, message, command):
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+        self.guild = message.guild
+        self.command = command
+        self.interaction = None
+
+    async def send(self, content=None, **kwargs):
+        await self.channel.send(content, **kwargs)
+
+    async def defer(self, **kwargs):
+        pass
+
+    def typing(self):
+        return FakeTyping()
+
+
+def synthetic_traffic(count, user_ids, seed):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.03:
+            events.append({"content": rng.choice(QOTD_LINES), "author": "quill"})
+        elif roll < 0.13:
+            events.append({"content": rng.choice(COMMAND_LINES), "author_id": rng.choice(user_ids)})
+        else:
+            events.append({"content": rng.choice(CHAT_LINES), "author_id": rng.choice(user_ids)})
+    return events
+
+
+def load_replay(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def populate(main, users, seed):
+    rng = random.Random(seed)
+    table = {}
+    for i in range(users):
+        xp = rng.randint(0, 60000)
+        table[str(1000 + i)] = {"xp": xp, "level": main.get_level_from_xp(xp, main.xp_table)}
+    main.user_store.guilds = {str(GUILD_ID): table}
+    main.user_store.loaded = True
+    for listener in main.user_store.listeners:
+        listener.rebuild(main.user_store)
+    main.guild_configs[GUILD_ID] = dict(main.legacy_guild_config)
+    main.bind_guild_routes()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+async def replay(main, events, rate):
+    guild = FakeGuild(GUILD_ID, [*main.level_roles.values(), main.final_role,
+                                 *(p["role"] for p in main.path_roles.values()), main.COLLECTOR_ROLE])
+    chat = FakeChannel(CHAT_CHANNEL_ID, guild)
+    nexus = FakeChannel(main.realm_nexus_channel_id, guild)
+    quill = guild.member(main.quill_bot_id, bot=True)
+
+    async def process_commands(message):
+        name, *args = message.content[len(main.bot.command_prefix):].split()
+        args = [int(arg) if arg.isdigit() else arg for arg in args]
+        command = main.bot.get_command(name)
+        if command is not None:
+            await command.callback(FakeContext(message, command), *args)
+
+    main.bot.process_commands = process_commands
+    main.bot.wait_for = lambda *args, **kwargs: asyncio.sleep(0, result=FakeMessage("no", quill, chat))
+
+    latencies = []
+    interval = 1.0 / rate if rate else 0.0
+    started = time.perf_counter()
+    for index, event in enumerate(events):
+        if interval:
+            delay = started + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if event.get("author") == "quill":
+            message = FakeMessage(event["content"], quill, nexus)
+        else:
+            author = guild.member(int(event["author_id"]), bot=event.get("bot", False))
+            message = FakeMessage(event["content"], author, chat)
+
+        t0 = time.perf_counter()
+        await main.on_message(message)
+        latencies.append(time.perf_counter() - t0)
+        if index % 1000 == 999:
+            main.apply_pending_xp(announce=False)
+    elapsed = time.perf_counter() - started
+
+    t0 = time.perf_counter()
+    main.apply_pending_xp(announce=False)
+    flushed = main.user_store.flush()
+    flush_seconds = time.perf_counter() - t0
+
+    # Let spawned background work settle before the process reports RSS
+    await asyncio.sleep(0)
+    latencies.sort()
+    return {
+        "messages": len(events),
+        "msgs_per_sec": round(len(events) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+        "flush_rows": flushed,
+        "flush_ms": round(flush_seconds * 1000, 2),
+    }
+
+
+def run_worker(args):
+    db_dir = tempfile.mkdtemp(prefix="bloodbun-bench-")
+    os.environ["BLOODBUN_DB"] = os.path.join(db_dir, "bench.db")
+    import main
+
+    main.state_backend.open()
+    main.reload_data_files()
+    populate(main, args.worker, args.seed)
+    user_ids = [user_id for user_id, _ in main.user_store.items(GUILD_ID)]
+    events = load_replay(args.replay) if args.replay else synthetic_traffic(args.messages, user_ids, args.seed)
+
+    result = asyncio.run(replay(main, events, args.rate))
+    result["users"] = args.worker
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    main.user_store.close()
+    print(json.dumps(result))
+
+
+def run_size(args, users):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", str(users),
+               "--messages", str(args.messages), "--rate", str(args.rate), "--seed", str(args.seed)]
+    if args.replay:
+        command += ["--replay", args.replay]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def scenario_name(args):
+    source = os.path.basename(args.replay) if args.replay else f"synthetic-{args.messages}"
+    return f"{source}@{args.rate or 'max'}"
+
+
+def compare(result, baseline, tolerance):
+    problems = []
+    if result["msgs_per_sec"] < baseline["msgs_per_sec"] * (1 - tolerance):
+        problems.append(f"throughput {result['msgs_per_sec']} < baseline {baseline['msgs_per_sec']}")
+    if result["p99_ms"] > max(baseline["p99_ms"] * (1 + tolerance), baseline["p99_ms"] + P99_SLACK_MS):
+        problems.append(f"p99 {result['p99_ms']}ms > baseline {baseline['p99_ms']}ms")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        problems.append(f"peak RSS {result['peak_rss_mb']}MB > baseline {baseline['peak_rss_mb']}MB")
+    return problems
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline BloodBun message-replay benchmark")
+    parser.add_argument("--users", default=DEFAULT_USERS, help="comma-separated user table sizes")
+    parser.add_argument("--messages", type=int, default=20000, help="synthetic messages per run")
+    parser.add_argument("--rate", type=float, default=0, help="messages/sec to replay at (0 = as fast as possible)")
+    parser.add_argument("--replay", help="JSONL of recorded messages: content, author_id or author=quill, bot")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-baseline", action="store_true", help=f"store results in {BASELINE_FILE}")
+    parser.add_argument("--check", action="store_true", help="fail if results regress past the stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.35, help="allowed regression fraction for --check")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run_worker(args)
+        return
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r") as f:
+            baselines = json.load(f)
+    scenario = baselines.setdefault(scenario_name(args), {})
+
+    failed = False
+    print(f"{'users':>9} {'msg/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'flush ms':>9} {'RSS MB':>8}")
+    for users in (int(size) for size in args.users.split(",")):
+        result = run_size(args, users)
+        print(f"{users:>9} {result['msgs_per_sec']:>10} {result['p50_ms']:>9} {result['p99_ms']:>9} "
+              f"{result['flush_ms']:>9} {result['peak_rss_mb']:>8}")
+        baseline = scenario.get(str(users))
+        if args.check and baseline:
+            for problem in compare(result, baseline, args.tolerance):
+                failed = True
+                print(f"  ❌ {problem}")
+        if args.save_baseline:
+            scenario[str(users)] = result
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=4)
+            f.write("\n")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
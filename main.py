@@ -1,17 +1,32 @@
 import asyncio
+import contextlib
+import functools
+import heapq
 import json
+import math
 import os
 import random
+import re
+import signal
+import socket
+import sqlite3
+import sys
+import threading
 import time
-from threading import Thread
+import uuid
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right, insort
+from types import MappingProxyType
 from typing import Optional
 import discord
-from discord.ext import commands
-from flask import Flask
-from waitress import serve
+from discord import app_commands
+from discord.ext import commands, tasks
+from aiohttp import web
 from discord import TextChannel
 
-command_locks = {}
 COMMAND_COOLDOWN = 3  # seconds
 
 
@@ -20,18 +35,455 @@ intents.messages = True
 intents.guilds = True
 intents.members = True
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-    
+
+
+# Sharding
+# BLOODBUN_SHARD_COUNT=auto runs every shard Discord recommends in this process. A
+# number plus BLOODBUN_SHARD_IDS (e.g. "0-3" or "4,5") runs only that range, so
+# several processes can split the bot; they share state through BLOODBUN_STATE_URL.
+# Processes on the same host each need their own BLOODBUN_HEALTH_PORT.
+SHARD_COUNT = os.getenv("BLOODBUN_SHARD_COUNT", "")
+SHARD_IDS = os.getenv("BLOODBUN_SHARD_IDS", "")
+SHARDED = bool(SHARD_COUNT)
+
+def parse_shard_ids(spec):
+    ids = []
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        first, _, last = part.partition("-")
+        ids += range(int(first), int(last or first) + 1)
+    return ids
+
+shard_options = {}
+if SHARD_COUNT and SHARD_COUNT != "auto":
+    shard_options["shard_count"] = int(SHARD_COUNT)
+    if SHARD_IDS:
+        shard_options["shard_ids"] = parse_shard_ids(SHARD_IDS)
+
+def owned_shard_filter():
+    # (shard_count, shard_ids) of the guilds this process loads; (None, None) is all of them
+    if "shard_ids" not in shard_options:
+        return None, None
+    return shard_options["shard_count"], shard_options["shard_ids"]
+
+
+class BloodBun(commands.AutoShardedBot if SHARDED else commands.Bot):
+    async def setup_hook(self):
+        instrument_http(self.http)
+        spawn(sample_loop_lag())
+        await start_health_server()
+        await state_backend.start()
+        state_backend.subscribe(on_state_event)
+        with metrics.timer("bloodbun_storage_seconds", op="load"):
+            await asyncio.to_thread(user_store.load)
+            await asyncio.to_thread(whisper_store.load)
+        cooldown_service.restore(await asyncio.to_thread(state_backend.load_cooldowns))
+        guild_configs.update(await asyncio.to_thread(state_backend.load_guild_configs))
+        bind_guild_routes()
+        haunt_scheduler.start()
+        flush_users.start()
+        flush_xp.start()
+        maintain_ledger.start()
+        sweep_cooldowns.start()
+        reload_data_files()
+        watch_data_files.start()
+        await sync_app_commands()
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except (NotImplementedError, RuntimeError):
+            pass  # Signal handlers are unavailable on Windows
+
+    async def close(self):
+        haunt_scheduler.stop()
+        flush_xp.cancel()
+        apply_pending_xp(announce=False)
+        flush_users.cancel()
+        maintain_ledger.cancel()
+        sweep_cooldowns.cancel()
+        await user_store.flush_async()
+        await whisper_store.flush_async()
+        await flush_cooldowns()
+        await checkpoint_ledger()
+        await super().close()
+        await stop_health_server()
+
+
+# Lean member mode keeps no full member list: no chunking at startup and only a
+# bounded LRU of recently active members (see "Member cache" below).
+LEAN_MEMBERS = os.getenv("BLOODBUN_LEAN_MEMBERS", "").lower() in ("1", "true", "yes")
+member_options = {}
+if LEAN_MEMBERS:
+    member_options = {"member_cache_flags": discord.MemberCacheFlags.none(), "chunk_guilds_at_startup": False}
+
+bot = BloodBun(command_prefix="!", intents=intents, **member_options, **shard_options)
+
+# Metrics
+# Fixed-bucket histograms, counters and gauges kept in plain dicts; recording is a
+# bisect and two additions. Exported in Prometheus text format on /metrics.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 1.0  # seconds
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return math.inf
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}  # name -> {labels: Histogram}
+        self.counters = {}  # name -> {labels: value}
+        self.gauges = {}  # name -> {labels: value}
+
+    def observe(self, name, value, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        self.gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def total(self, name):
+        return sum(self.counters.get(name, {}).values())
+
+    def merged(self, name):
+        merged = Histogram()
+        for histogram in self.histograms.get(name, {}).values():
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.sum += histogram.sum
+            merged.count += histogram.count
+        return merged
+
+    def render(self):
+        def fmt(labels, extra=()):
+            # JSON string escaping matches the Prometheus label value rules
+            pairs = [f"{k}={json.dumps(str(v), ensure_ascii=False)}" for k, v in (*labels, *extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{fmt(labels)} {value}" for labels, value in series.items()]
+        for name, series in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines += [f"{name}{fmt(labels)} {value}" for labels, value in series.items()]
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{fmt(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{fmt(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def instrument_http(http):
+    # Times every Discord REST call by route template and counts failures by status
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        route_name = f"{route.method} {route.path}"
+        started = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        except discord.HTTPException as e:
+            metrics.inc("bloodbun_discord_api_errors_total", route=route_name, status=e.status)
+            raise
+        finally:
+            metrics.observe("bloodbun_discord_api_seconds", time.perf_counter() - started, route=route_name)
+
+    http.request = timed_request
+
+async def sample_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(loop.time() - started - LOOP_LAG_INTERVAL, 0.0)
+        metrics.observe("bloodbun_event_loop_lag_seconds", lag)
+        metrics.set("bloodbun_event_loop_lag_last_seconds", lag)
+
 # XP settings
 MIN_XP = 15
 MAX_XP = 25
 XP_COOLDOWN = 60
-cooldowns = {}
+XP_FLUSH_INTERVAL = 5  # seconds
 
 # Reset cooldowns
-reset_cooldowns = {}
 RESET_COOLDOWN_SECONDS = 86400  # 24 hours
 
+# Cooldowns and rate limits
+# Every limiter lives in one CooldownService. Entries carry an expiry and are kept
+# in a heap, so idle keys are dropped by the sweeper and memory tracks only keys
+# that are still cooling down. Policies marked persist survive restarts.
+COOLDOWN_SWEEP_INTERVAL = 60  # seconds
+COOLDOWN_MAX_ENTRIES = 200_000
+
+class FixedWindow:
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+
+    def consume(self, state, now):
+        start, count = state if state and now < state[0] + self.window else (now, 0)
+        if count >= self.limit:
+            return state, start + self.window - now, start + self.window
+        return (start, count + 1), 0.0, start + self.window
+
+    def peek(self, state, now):
+        if state and now < state[0] + self.window and state[1] >= self.limit:
+            return state[0] + self.window - now
+        return 0.0
+
+class TokenBucket:
+    def __init__(self, capacity, per):
+        self.capacity = capacity
+        self.per = per  # seconds to refill one token
+
+    def _tokens(self, state, now):
+        if not state:
+            return float(self.capacity)
+        tokens, updated = state
+        return min(self.capacity, tokens + (now - updated) / self.per)
+
+    def consume(self, state, now):
+        tokens = self._tokens(state, now)
+        if tokens < 1:
+            return (tokens, now), (1 - tokens) * self.per, now + (self.capacity - tokens) * self.per
+        tokens -= 1
+        return (tokens, now), 0.0, now + (self.capacity - tokens) * self.per
+
+    def peek(self, state, now):
+        tokens = self._tokens(state, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) * self.per
+
+class CooldownService:
+    def __init__(self, max_entries=COOLDOWN_MAX_ENTRIES):
+        self.policies = {}
+        self.persistent = set()
+        self.entries = {}  # (policy, key) -> (state, expires_at)
+        self.heap = []  # (expires_at, policy, key); stale items are skipped lazily
+        self.locks = weakref.WeakValueDictionary()
+        self.max_entries = max_entries
+        self.persist_dirty = False
+
+    def add_policy(self, name, policy, persist=False):
+        self.policies[name] = policy
+        if persist:
+            self.persistent.add(name)
+
+    def hit(self, name, key, now=None):
+        # Consume one use; returns 0 when allowed, otherwise seconds until allowed
+        now = time.time() if now is None else now
+        entry_key = (name, str(key))
+        entry = self.entries.get(entry_key)
+        state, retry_after, expires_at = self.policies[name].consume(entry[0] if entry else None, now)
+        if retry_after:
+            return retry_after
+        self.entries[entry_key] = (state, expires_at)
+        heapq.heappush(self.heap, (expires_at, name, entry_key[1]))
+        if name in self.persistent:
+            self.persist_dirty = True
+        if len(self.entries) > self.max_entries:
+            self.evict(len(self.entries) - self.max_entries)
+        return 0.0
+
+    def retry_after(self, name, key, now=None):
+        now = time.time() if now is None else now
+        entry = self.entries.get((name, str(key)))
+        return self.policies[name].peek(entry[0] if entry else None, now)
+
+    def reset(self, name, key):
+        if self.entries.pop((name, str(key)), None) and name in self.persistent:
+            self.persist_dirty = True
+
+    def _pop_live(self):
+        expires_at, name, key = heapq.heappop(self.heap)
+        entry = self.entries.get((name, key))
+        if entry is None or entry[1] != expires_at:
+            return False
+        del self.entries[(name, key)]
+        if name in self.persistent:
+            self.persist_dirty = True
+        return True
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        while self.heap and self.heap[0][0] <= now:
+            removed += self._pop_live()
+        if len(self.heap) > 2 * len(self.entries) + 1024:
+            self.heap = [(expires_at, name, key) for (name, key), (_, expires_at) in self.entries.items()]
+            heapq.heapify(self.heap)
+        return removed
+
+    def evict(self, count):
+        # Over budget: drop the entries closest to expiring first
+        while count > 0 and self.heap:
+            count -= self._pop_live()
+
+    async def acquire(self, name, key):
+        # Waits until the policy allows another use, then consumes it
+        while True:
+            retry_after = self.hit(name, key)
+            if not retry_after:
+                return
+            await asyncio.sleep(retry_after)
+
+    def lock(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+    def persistent_rows(self):
+        return [
+            (name, key, json.dumps(state), expires_at)
+            for (name, key), (state, expires_at) in self.entries.items()
+            if name in self.persistent
+        ]
+
+    def restore(self, rows, now=None):
+        now = time.time() if now is None else now
+        for name, key, state, expires_at in rows:
+            if name in self.persistent and expires_at > now:
+                self.entries[(name, key)] = (tuple(json.loads(state)), expires_at)
+                heapq.heappush(self.heap, (expires_at, name, key))
+
+cooldown_service = CooldownService()
+cooldown_service.add_policy("xp", FixedWindow(1, XP_COOLDOWN))
+cooldown_service.add_policy("command", TokenBucket(2, COMMAND_COOLDOWN))
+cooldown_service.add_policy("resetpath", FixedWindow(1, RESET_COOLDOWN_SECONDS), persist=True)
+
+# Extra per-user limits for individual commands, on top of the global "command" bucket
+command_policies = {"bloodwhisper": "whisper"}
+cooldown_service.add_policy("whisper", FixedWindow(3, 300))
+
+def guild_key(guild_id, user_id):
+    # Per-user limits are kept separately for every guild the user is in
+    return f"{guild_id}:{user_id}"
+
+@tasks.loop(seconds=COOLDOWN_SWEEP_INTERVAL)
+async def sweep_cooldowns():
+    cooldown_service.sweep()
+
+def per_user_lock(func):
+    # Serialises a command per user so double-sent commands can't race each other
+    @functools.wraps(func)
+    async def wrapper(ctx, *args, **kwargs):
+        async with cooldown_service.lock(ctx.author.id):
+            return await func(ctx, *args, **kwargs)
+    return wrapper
+
+@bot.before_invoke
+async def command_rate_limit(ctx):
+    # Charged in before_invoke rather than as a check: checks also run from can_run
+    # (e.g. when !help filters the command list) and must stay side-effect free.
+    for name in ("command", command_policies.get(ctx.command.qualified_name)):
+        if name is None:
+            continue
+        retry_after = cooldown_service.hit(name, guild_key(ctx.guild.id if ctx.guild else 0, ctx.author.id))
+        if retry_after:
+            policy = cooldown_service.policies[name]
+            rate, per = (policy.limit, policy.window) if isinstance(policy, FixedWindow) else (policy.capacity, policy.per)
+            raise commands.CommandOnCooldown(commands.Cooldown(rate, per), retry_after, commands.BucketType.user)
+
+@bot.event
+async def on_command(ctx):
+    ctx.metrics_started = time.perf_counter()
+
+def observe_command(ctx, outcome):
+    started = getattr(ctx, "metrics_started", None)
+    if started is not None and ctx.command is not None:
+        metrics.observe("bloodbun_command_seconds", time.perf_counter() - started, command=ctx.command.qualified_name)
+    metrics.inc("bloodbun_commands_total", command=ctx.command.qualified_name if ctx.command else "unknown", outcome=outcome)
+
+@bot.event
+async def on_command_completion(ctx):
+    observe_command(ctx, "ok")
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.CommandNotFound):
+        return
+    observe_command(ctx, type(error).__name__)
+    if isinstance(error, commands.CommandOnCooldown):
+        await ctx.send(f"🌌 Patience... try again in **{error.retry_after:.0f}s**.", delete_after=5, ephemeral=True)
+        return
+    if isinstance(error, commands.NoPrivateMessage):
+        await ctx.send("🌌 That only works inside a Realm server.", ephemeral=True)
+        return
+    if ctx.interaction is not None and isinstance(error, commands.CheckFailure):
+        # Prefix invocations fail silently; an interaction must still be answered
+        await ctx.send("🌌 You can't use that command here.", ephemeral=True)
+        return
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+# Slash commands
+# Every command is a hybrid command: `!name` still works, and the same callback is
+# registered as `/name`. The process owning shard 0 bulk-syncs the tree at startup.
+# Personal replies pass ephemeral=True, which prefix invocations ignore, and
+# commands that touch storage or the API defer first so a slow write can't miss
+# the 3-second interaction deadline (defer is a no-op for prefix invocations).
+SYNC_APP_COMMANDS = os.getenv("BLOODBUN_SYNC_COMMANDS", "1").lower() in ("1", "true", "yes")
+
+async def sync_app_commands():
+    _, shard_ids = owned_shard_filter()
+    if not SYNC_APP_COMMANDS or (shard_ids is not None and 0 not in shard_ids):
+        return
+    try:
+        synced = await bot.tree.sync()
+    except discord.HTTPException as e:
+        print(f"Error syncing slash commands: {e}")
+        return
+    print(f"🔗 Synced {len(synced)} slash command(s)")
+
+async def reply_privately(ctx, content, fallback=None):
+    # DMs the author, or answers ephemerally when invoked as a slash command
+    if ctx.interaction is not None:
+        await ctx.send(content, ephemeral=True)
+        return
+    try:
+        await ctx.author.send(content)
+    except discord.Forbidden:
+        await ctx.send(fallback or content)
+
 # XP table
 def generate_xp_table(max_level=100):
     xp_table = {}
@@ -41,16 +493,38 @@ def generate_xp_table(max_level=100):
         xp_table[level] = xp
     return xp_table
 
-xp_table = generate_xp_table()
+def xp_curve(xp_table):
+    levels = sorted(xp_table)
+    return levels, [xp_table[lvl] for lvl in levels]
+
+# The live table is read-only and only ever replaced through set_xp_table, which
+# rebuilds the precomputed curve with it; so the curve is valid for exactly the
+# table object it was built from and lookups stay a single bisect.
+def set_xp_table(table):
+    global xp_table, xp_curve_cache
+    xp_table = MappingProxyType(dict(table))
+    xp_curve_cache = (xp_table, *xp_curve(xp_table))
+
+set_xp_table(generate_xp_table())
 
 def get_level_from_xp(xp, xp_table):
-    level = 0
-    for lvl, required_xp in sorted(xp_table.items()):
-        if xp >= required_xp:
-            level = lvl
-        else:
-            break
-    return level
+    source, levels, thresholds = xp_curve_cache
+    if xp_table is not source:
+        levels, thresholds = xp_curve(xp_table)
+    index = bisect_right(thresholds, xp)
+    return levels[index - 1] if index else 0
+
+def recompute_levels(store, xp_table):
+    # Bulk pass over the whole table after a curve change; returns how many rows moved
+    levels, thresholds = xp_curve(xp_table)
+    changed = 0
+    for guild_id, user_id, user_data in store.all_items():
+        index = bisect_right(thresholds, user_data["xp"])
+        level = levels[index - 1] if index else 0
+        if level != user_data["level"]:
+            store.update(guild_id, user_id, kind="recompute", level=level)
+            changed += 1
+    return changed
 
 # Role rewards
 level_roles = {
@@ -66,6 +540,8 @@ level_messages = {
 }
 
 # Path system
+PATH_MIN_LEVEL = 20
+
 path_roles = {
     "flame": {
         "role": "Flamebound",
@@ -121,27 +597,1142 @@ final_message = (
     "_Your presence echoes in the silence between stars. The Realm does not guide you—you are the path._"
 )
 
+# Role registry
+# name -> Role and role ID -> path per guild, built on first use and kept current
+# from gateway role events, so path and reward lookups never scan guild.roles.
+COLLECTOR_ROLE = "🐰Collector"
+
+class RoleRegistry:
+    def __init__(self):
+        self.by_name = {}  # guild_id -> {name: Role}
+        self.paths = {}  # guild_id -> {role_id: path_key}
+
+    def index_guild(self, guild):
+        # Earlier roles win on duplicate names, matching discord.utils.get
+        self.by_name[guild.id] = {role.name: role for role in reversed(guild.roles)}
+        self._index_paths(guild.id)
+
+    def _index_paths(self, guild_id):
+        roles = self.by_name.get(guild_id, {})
+        self.paths[guild_id] = {
+            roles[path_data["role"]].id: path_key
+            for path_key, path_data in path_roles.items()
+            if path_data["role"] in roles
+        }
+
+    def _roles(self, guild):
+        roles = self.by_name.get(guild.id)
+        if roles is None:
+            self.index_guild(guild)
+            roles = self.by_name[guild.id]
+        return roles
+
+    def forget_guild(self, guild_id):
+        self.by_name.pop(guild_id, None)
+        self.paths.pop(guild_id, None)
+
+    def role_created(self, role):
+        if role.guild.id in self.by_name:
+            self.by_name[role.guild.id].setdefault(role.name, role)
+            self._index_paths(role.guild.id)
+
+    def role_deleted(self, role):
+        roles = self.by_name.get(role.guild.id)
+        if roles is None:
+            return
+        if roles.get(role.name) is not None and roles[role.name].id == role.id:
+            # Fall back to another role with the same name, if there is one
+            replacement = discord.utils.get(role.guild.roles, name=role.name)
+            if replacement is None or replacement.id == role.id:
+                del roles[role.name]
+            else:
+                roles[role.name] = replacement
+        self._index_paths(role.guild.id)
+
+    def role_updated(self, before, after):
+        if before.name != after.name:
+            self.role_deleted(before)
+            self.role_created(after)
+        elif after.guild.id in self.by_name:
+            current = self.by_name[after.guild.id].get(after.name)
+            if current is not None and current.id == after.id:
+                self.by_name[after.guild.id][after.name] = after
+
+    def get(self, guild, name):
+        return self._roles(guild).get(name)
+
+    def member_path(self, member):
+        self._roles(member.guild)
+        for role_id, path_key in self.paths[member.guild.id].items():
+            if member.get_role(role_id) is not None:
+                return path_key
+        return None
+
+    def member_path_roles(self, member):
+        self._roles(member.guild)
+        return [role for role in (member.get_role(role_id) for role_id in self.paths[member.guild.id]) if role]
+
+role_registry = RoleRegistry()
+
+@bot.event
+async def on_guild_available(guild):
+    role_registry.index_guild(guild)
+    await adopt_legacy_guild(guild)
+
+@bot.event
+async def on_guild_join(guild):
+    role_registry.index_guild(guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    role_registry.forget_guild(guild.id)
+
+@bot.event
+async def on_guild_role_create(role):
+    role_registry.role_created(role)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    role_registry.role_updated(before, after)
+
+@bot.event
+async def on_guild_role_delete(role):
+    role_registry.role_deleted(role)
+
 # Data handling
-def load_data():
-    if not os.path.exists("users.json"):
+DB_PATH = os.getenv("BLOODBUN_DB", "bloodbun.db")
+LEGACY_USERS_FILE = "users.json"
+FLUSH_INTERVAL = 30  # seconds
+LEGACY_GUILD_ID = "0"  # rows stored before progression was partitioned by guild
+GUILD_CONFIG_COLUMNS = ("news_channel_id", "nexus_channel_id", "stream_bot_id", "qotd_bot_id")
+
+# Per-guild tables; the whole key is (guild_id, user_id)
+PARTITIONED_TABLES = {
+    "users": """(
+        guild_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        xp INTEGER NOT NULL DEFAULT 0,
+        level INTEGER NOT NULL DEFAULT 0,
+        name TEXT,
+        PRIMARY KEY (guild_id, user_id)
+    )""",
+    "whispers": """(
+        guild_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        haunted INTEGER NOT NULL DEFAULT 0,
+        mask BLOB,
+        heard INTEGER NOT NULL DEFAULT 0,
+        next_haunt REAL,
+        PRIMARY KEY (guild_id, user_id)
+    )""",
+}
+
+def load_data(path=LEGACY_USERS_FILE):
+    if not os.path.exists(path):
         return {}
-    with open("users.json", "r") as f:
+    with open(path, "r") as f:
         return json.load(f)
 
-def save_data(data):
-    with open("users.json", "w") as f:
-        json.dump(data, f, indent=4)
+# State backend
+# Everything that outlives a process goes through state_backend: the SQLite tables
+# for progression, whispers, cooldowns and guild config, rate limits shared by
+# every shard, and events that have to reach every process. LocalState does all of
+# it in-process. With BLOODBUN_STATE_URL set, RemoteState forwards the same calls to
+# a `python main.py state-server` process, so several shard processes share one
+# database and one set of limits. Storage methods block and are called through
+# asyncio.to_thread; start, hit, acquire and publish are coroutines.
+STATE_URL = os.getenv("BLOODBUN_STATE_URL", "")
+STATE_DEFAULT_ADDRESS = "127.0.0.1:7450"
+STATE_TIMEOUT = 10.0  # seconds
+STATE_RECONNECT_DELAY = 5.0
+
+class StateError(Exception):
+    pass
+
+def fold_events(table, events):
+    # Applies (guild_id, user_id, xp gained, level after or None) events in order to
+    # {(guild_id, user_id): [xp, level]}; level stays None until an event sets it
+    for guild_id, user_id, xp, level in events:
+        row = table.setdefault((guild_id, user_id), [0, None])
+        row[0] += xp
+        if level is not None:
+            row[1] = level
+    return table
+
+STORAGE_ERRORS = (sqlite3.Error, OSError, StateError)
+
+class StateBackend:
+    def __init__(self):
+        self.handlers = []
+
+    def subscribe(self, handler):
+        self.handlers.append(handler)
+
+    def notify(self, event):
+        for handler in self.handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"Error handling state event {event.get('kind')}: {e!r}")
+
+    async def start(self):
+        pass
+
+    async def publish(self, event):
+        # Tells every other process; the publisher has already applied the change
+        pass
+
+    async def acquire(self, name, key):
+        while True:
+            retry_after = await self.hit(name, key)
+            if not retry_after:
+                return
+            await asyncio.sleep(retry_after)
+
+class LocalState(StateBackend):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.db = None
+        self._write_lock = threading.Lock()
+
+    def open(self):
+        if self.db is not None:
+            return
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for table, schema in PARTITIONED_TABLES.items():
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} {schema}")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS cooldowns (
+                policy TEXT NOT NULL,
+                key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (policy, key)
+            );
+            CREATE TABLE IF NOT EXISTS guild_config (
+                guild_id TEXT PRIMARY KEY,
+                news_channel_id INTEGER,
+                nexus_channel_id INTEGER,
+                stream_bot_id INTEGER,
+                qotd_bot_id INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS xp_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                at REAL NOT NULL,
+                guild_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                xp INTEGER NOT NULL DEFAULT 0,
+                level INTEGER,
+                detail TEXT
+            );
+            CREATE INDEX IF NOT EXISTS xp_events_user ON xp_events (guild_id, user_id, seq);
+            CREATE TABLE IF NOT EXISTS ledger_snapshots (
+                id INTEGER PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                taken_at REAL NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS ledger_batches (
+                batch_id TEXT PRIMARY KEY,
+                at REAL NOT NULL
+            );
+        """)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(users)")}
+        if "name" not in columns:
+            self.db.execute("ALTER TABLE users ADD COLUMN name TEXT")
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(whispers)")}
+        if "next_haunt" not in columns:
+            self.db.execute("ALTER TABLE whispers ADD COLUMN next_haunt REAL")
+        for table, schema in PARTITIONED_TABLES.items():
+            self._partition(table, schema)
+        self.db.execute("CREATE INDEX IF NOT EXISTS users_guild_rank ON users (guild_id, level DESC, xp DESC)")
+        self.migrate_legacy_json(LEGACY_USERS_FILE)
+
+    def _partition(self, table, schema):
+        # Tables from before guild partitioning are keyed by user_id alone; their rows
+        # are kept under LEGACY_GUILD_ID until the home guild claims them.
+        columns = [row[1] for row in self.db.execute(f"PRAGMA table_info({table})")]
+        if "guild_id" in columns:
+            return
+        names = ", ".join(columns)
+        self.db.executescript(f"""
+            BEGIN;
+            ALTER TABLE {table} RENAME TO {table}_unpartitioned;
+            CREATE TABLE {table} {schema};
+            INSERT INTO {table} (guild_id, {names}) SELECT '{LEGACY_GUILD_ID}', {names} FROM {table}_unpartitioned;
+            DROP TABLE {table}_unpartitioned;
+            COMMIT;
+        """)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def migrate_legacy_json(self, path):
+        # One-time import of the old users.json; the file is left in place as a backup.
+        if self.get_meta("legacy_json_migrated") or not os.path.exists(path):
+            return 0
+        data = load_data(path)
+        rows = [
+            (LEGACY_GUILD_ID, str(user_id), int(user_data.get("xp", 0)), int(user_data.get("level", 0)))
+            for user_id, user_data in data.items()
+        ]
+        with self._write_lock, self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO users (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?)", rows
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_migrated', ?)",
+                (str(int(time.time())),)
+            )
+        print(f"📦 Migrated {len(rows)} user(s) from {path} into {self.path}")
+        return len(rows)
+
+    def _owned(self, shard_count, shard_ids):
+        # WHERE clause for guilds on the given shards, plus unclaimed legacy rows
+        if shard_ids is None:
+            return "1", ()
+        placeholders = ", ".join("?" * len(shard_ids))
+        return (f"(guild_id = ? OR (CAST(guild_id AS INTEGER) >> 22) % ? IN ({placeholders}))",
+                (LEGACY_GUILD_ID, shard_count, *shard_ids))
+
+    def _select_owned(self, columns, table, shard_count, shard_ids):
+        clause, params = self._owned(shard_count, shard_ids)
+        return self.db.execute(f"SELECT {columns} FROM {table} WHERE {clause}", params).fetchall()
+
+    def load_users(self, shard_count=None, shard_ids=None):
+        # The users table as of the last checkpoint, plus the log tail replayed on top
+        clause, params = self._owned(shard_count, shard_ids)
+        with self._write_lock:
+            since = int(self.get_meta("users_seq", 0))
+            rows = self._select_owned("guild_id, user_id, xp, level, name", "users", shard_count, shard_ids)
+            tail = self.db.execute(
+                f"SELECT guild_id, user_id, xp, level FROM xp_events WHERE seq > ? AND {clause} ORDER BY seq",
+                (since, *params)
+            ).fetchall()
+        table = fold_events({(guild_id, user_id): [xp, level] for guild_id, user_id, xp, level, _ in rows}, tail)
+        names = {(guild_id, user_id): name for guild_id, user_id, _, _, name in rows}
+        return [(guild_id, user_id, xp, level or 0, names.get((guild_id, user_id))) for (guild_id, user_id), (xp, level) in table.items()]
+
+    def append_events(self, batch_id, events, names):
+        # The hot-path write: new ledger rows and changed display names in one transaction.
+        # events are (at, guild_id, user_id, kind, xp gained, level after or None, detail).
+        # A batch_id that was already applied is ignored, so a client may resend a batch
+        # whose reply it never saw without counting its XP twice.
+        with self._write_lock, self.db:
+            if not self.db.execute(
+                "INSERT OR IGNORE INTO ledger_batches (batch_id, at) VALUES (?, ?)", (batch_id, time.time())
+            ).rowcount:
+                return False
+            self.db.executemany(
+                "INSERT INTO xp_events (at, guild_id, user_id, kind, xp, level, detail) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                events
+            )
+            self.db.executemany(
+                "INSERT INTO users (guild_id, user_id, name) VALUES (?, ?, ?) "
+                "ON CONFLICT(guild_id, user_id) DO UPDATE SET name = excluded.name",
+                names
+            )
+        return True
+
+    def checkpoint(self):
+        # Folds logged events into the users table and advances users_seq past them.
+        # XP is added in SQL, so the table is only ever moved forward by increments.
+        with self._write_lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            since = int(self.get_meta("users_seq", 0))
+            events = self.db.execute(
+                "SELECT seq, guild_id, user_id, xp, level FROM xp_events WHERE seq > ? ORDER BY seq", (since,)
+            ).fetchall()
+            if not events:
+                return 0
+            changes = fold_events({}, (event[1:] for event in events))
+            self.db.executemany(
+                "INSERT INTO users (guild_id, user_id, xp, level) VALUES (?, ?, ?, COALESCE(?, 0)) "
+                "ON CONFLICT(guild_id, user_id) DO UPDATE SET xp = xp + excluded.xp, level = COALESCE(?, level)",
+                [(guild_id, user_id, xp, level, level) for (guild_id, user_id), (xp, level) in changes.items()]
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('users_seq', ?)", (str(events[-1][0]),)
+            )
+        return len(events)
+
+    def snapshot_if_due(self, interval):
+        # Archives the checkpointed users table for point-in-time rebuilds
+        with self._write_lock, self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            last = self.db.execute("SELECT MAX(taken_at) FROM ledger_snapshots").fetchone()[0]
+            if last is not None and time.time() - last < interval:
+                return False
+            data = {}
+            for guild_id, user_id, xp, level in self.db.execute("SELECT guild_id, user_id, xp, level FROM users"):
+                data.setdefault(guild_id, {})[user_id] = [xp, level]
+            self.db.execute(
+                "INSERT INTO ledger_snapshots (seq, taken_at, data) VALUES (?, ?, ?)",
+                (int(self.get_meta("users_seq", 0)), time.time(), zlib.compress(json.dumps(data).encode()))
+            )
+        return True
+
+    def compact_ledger(self, keep):
+        # Drops all but the newest `keep` snapshots, then every event they already cover
+        with self._write_lock, self.db:
+            self.db.execute(
+                "DELETE FROM ledger_snapshots WHERE id NOT IN "
+                "(SELECT id FROM ledger_snapshots ORDER BY taken_at DESC LIMIT ?)", (keep,)
+            )
+            oldest, taken_at = self.db.execute("SELECT MIN(seq), MIN(taken_at) FROM ledger_snapshots").fetchone()
+            if oldest is None:
+                return 0
+            self.db.execute("DELETE FROM ledger_batches WHERE at < ?", (taken_at,))
+            floor = min(oldest, int(self.get_meta("users_seq", 0)))
+            return self.db.execute("DELETE FROM xp_events WHERE seq <= ?", (floor,)).rowcount
+
+    def rebuild_users(self, guild_id, at):
+        # {user_id: [xp, level]} for one guild as of `at`, or None if the ledger starts later
+        guild_id = str(guild_id)
+        snapshot = self.db.execute(
+            "SELECT seq, data FROM ledger_snapshots WHERE taken_at <= ? ORDER BY taken_at DESC LIMIT 1", (at,)
+        ).fetchone()
+        if snapshot is None:
+            return None
+        seq, data = snapshot
+        users = json.loads(zlib.decompress(data)).get(guild_id, {})
+        events = self.db.execute(
+            "SELECT guild_id, user_id, xp, level FROM xp_events WHERE guild_id = ? AND seq > ? AND at <= ? ORDER BY seq",
+            (guild_id, seq, at)
+        ).fetchall()
+        table = fold_events({(guild_id, user_id): row for user_id, row in users.items()}, events)
+        return {user_id: [xp, level or 0] for (_, user_id), (xp, level) in table.items()}
+
+    def load_events(self, guild_id, user_id, limit):
+        return self.db.execute(
+            "SELECT at, kind, xp, level, detail FROM xp_events WHERE guild_id = ? AND user_id = ? "
+            "ORDER BY seq DESC LIMIT ?",
+            (str(guild_id), str(user_id), limit)
+        ).fetchall()
+
+    def load_whispers(self, shard_count=None, shard_ids=None):
+        rows = self._select_owned("guild_id, user_id, haunted, mask, heard, next_haunt", "whispers",
+                                  shard_count, shard_ids)
+        return [
+            (guild_id, user_id, haunted, int.from_bytes(mask or b"", "little"), heard, next_haunt)
+            for guild_id, user_id, haunted, mask, heard, next_haunt in rows
+        ]
+
+    def write_whispers(self, batch):
+        rows = [
+            (guild_id, user_id, haunted, mask.to_bytes((mask.bit_length() + 7) // 8, "little"), heard, next_haunt)
+            for guild_id, user_id, haunted, mask, heard, next_haunt in batch
+        ]
+        with self._write_lock, self.db:
+            self.db.executemany(
+                "INSERT INTO whispers (guild_id, user_id, haunted, mask, heard, next_haunt) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(guild_id, user_id) DO UPDATE SET haunted = excluded.haunted, mask = excluded.mask, "
+                "heard = excluded.heard, next_haunt = excluded.next_haunt",
+                rows
+            )
+
+    def claim_legacy_rows(self, guild_id):
+        # Moves legacy rows, their ledger events and their part of every snapshot into
+        # guild_id; users the guild already has keep their own progression everywhere.
+        guild_id = str(guild_id)
+        with self._write_lock, self.db:
+            self.db.execute(
+                "UPDATE xp_events SET guild_id = ? WHERE guild_id = ? "
+                "AND user_id NOT IN (SELECT user_id FROM users WHERE guild_id = ?)",
+                (guild_id, LEGACY_GUILD_ID, guild_id)
+            )
+            self.db.execute("DELETE FROM xp_events WHERE guild_id = ?", (LEGACY_GUILD_ID,))
+            for table in PARTITIONED_TABLES:
+                self.db.execute(f"UPDATE OR IGNORE {table} SET guild_id = ? WHERE guild_id = ?",
+                                (guild_id, LEGACY_GUILD_ID))
+                self.db.execute(f"DELETE FROM {table} WHERE guild_id = ?", (LEGACY_GUILD_ID,))
+            for snapshot_id, data in self.db.execute("SELECT id, data FROM ledger_snapshots").fetchall():
+                guilds = json.loads(zlib.decompress(data))
+                if LEGACY_GUILD_ID not in guilds:
+                    continue
+                users = guilds.setdefault(guild_id, {})
+                for user_id, row in guilds.pop(LEGACY_GUILD_ID).items():
+                    users.setdefault(user_id, row)
+                self.db.execute("UPDATE ledger_snapshots SET data = ? WHERE id = ?",
+                                (zlib.compress(json.dumps(guilds).encode()), snapshot_id))
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._write_lock, self.db:
+            self.db.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(value))
+            )
+
+    def load_cooldowns(self):
+        return self.db.execute("SELECT policy, key, state, expires_at FROM cooldowns").fetchall()
+
+    def save_cooldowns(self, rows):
+        # Upsert rather than replace the table: other processes keep their own rows
+        with self._write_lock, self.db:
+            self.db.execute("DELETE FROM cooldowns WHERE expires_at <= ?", (time.time(),))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO cooldowns (policy, key, state, expires_at) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def load_guild_configs(self):
+        rows = self.db.execute(f"SELECT guild_id, {', '.join(GUILD_CONFIG_COLUMNS)} FROM guild_config")
+        return {int(row[0]): dict(zip(GUILD_CONFIG_COLUMNS, row[1:])) for row in rows}
+
+    def save_guild_config(self, guild_id, config):
+        with self._write_lock, self.db:
+            self.db.execute(
+                f"INSERT OR REPLACE INTO guild_config (guild_id, {', '.join(GUILD_CONFIG_COLUMNS)}) "
+                f"VALUES (?{', ?' * len(GUILD_CONFIG_COLUMNS)})",
+                (str(guild_id), *(config.get(column) for column in GUILD_CONFIG_COLUMNS))
+            )
+
+    async def hit(self, name, key):
+        return cooldown_service.hit(name, key)
+
+# Calls a RemoteState may make; the state server refuses anything else
+STATE_METHODS = {
+    "load_users", "append_events", "load_whispers", "write_whispers", "claim_legacy_rows",
+    "checkpoint", "snapshot_if_due", "compact_ledger", "rebuild_users", "load_events",
+    "get_meta", "set_meta", "load_cooldowns", "save_cooldowns", "load_guild_configs", "save_guild_config", "hit",
+}
+
+def parse_address(url):
+    host, port = (url.removeprefix("tcp://") or STATE_DEFAULT_ADDRESS).rsplit(":", 1)
+    return host, int(port)
+
+class RemoteState(StateBackend):
+    # Storage calls share one blocking JSON-lines connection; events arrive on a
+    # second, asyncio connection that reconnects on its own.
+    def __init__(self, url):
+        super().__init__()
+        self.address = parse_address(url)
+        self.conn = None
+        self._lock = threading.Lock()
+        self.events = None
+
+    def call(self, method, *args):
+        with self._lock:
+            try:
+                if self.conn is None:
+                    self.conn = socket.create_connection(self.address, timeout=STATE_TIMEOUT).makefile("rwb")
+                self.conn.write(json.dumps({"method": method, "args": args}).encode() + b"\n")
+                self.conn.flush()
+                line = self.conn.readline()
+                if not line:
+                    raise ConnectionError("state server closed the connection")
+            except OSError:
+                # Never resend: a write may already have been applied
+                self.close()
+                raise
+        reply = json.loads(line)
+        if "error" in reply:
+            raise StateError(reply["error"])
+        return reply["result"]
+
+    def __getattr__(self, name):
+        if name not in STATE_METHODS:
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    def open(self):
+        pass
+
+    def close(self):
+        if self.conn is not None:
+            with contextlib.suppress(OSError):
+                self.conn.close()
+            self.conn = None
+
+    def load_guild_configs(self):
+        # JSON object keys are strings
+        return {int(guild_id): config for guild_id, config in self.call("load_guild_configs").items()}
+
+    async def hit(self, name, key):
+        return await asyncio.to_thread(self.call, "hit", name, str(key))
+
+    async def start(self):
+        spawn(self.listen())
+
+    async def listen(self):
+        while True:
+            try:
+                reader, self.events = await asyncio.open_connection(*self.address)
+                self.events.write(b'{"subscribe": true}\n')
+                await self.events.drain()
+                while line := await reader.readline():
+                    self.notify(json.loads(line)["event"])
+            except OSError as e:
+                print(f"State server event stream lost: {e}")
+            self.events = None
+            await asyncio.sleep(STATE_RECONNECT_DELAY)
+
+    async def publish(self, event):
+        if self.events is None:
+            print(f"State server unreachable; {event['kind']} was not broadcast")
+            return
+        self.events.write(json.dumps({"publish": event}).encode() + b"\n")
+        await self.events.drain()
+
+class StateServer:
+    # Serves a LocalState to RemoteState clients and fans events out between them
+    def __init__(self, backend):
+        self.backend = backend
+        self.subscribers = set()
 
-@bot.command(name="stats")
+    async def handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                if request.get("subscribe"):
+                    self.subscribers.add(writer)
+                    continue
+                if "publish" in request:
+                    message = json.dumps({"event": request["publish"]}).encode() + b"\n"
+                    for subscriber in self.subscribers - {writer}:
+                        subscriber.write(message)
+                    continue
+                writer.write(json.dumps(await self.dispatch(request["method"], request["args"])).encode() + b"\n")
+                await writer.drain()
+        except (OSError, ValueError) as e:
+            print(f"State client dropped: {e!r}")
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    async def dispatch(self, method, args):
+        try:
+            if method not in STATE_METHODS:
+                raise StateError(f"unknown method {method}")
+            if method == "hit":
+                return {"result": await self.backend.hit(*args)}
+            return {"result": await asyncio.to_thread(getattr(self.backend, method), *args)}
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+async def run_state_server(url):
+    state = LocalState(DB_PATH)
+    state.open()
+    host, port = parse_address(url)
+    server = await asyncio.start_server(StateServer(state).handle, host, port)
+    sweep_cooldowns.start()
+    print(f"🗄️ State server on {host}:{port} using {DB_PATH}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        state.close()
+
+state_backend = RemoteState(STATE_URL) if STATE_URL else LocalState(DB_PATH)
+
+class UserStore:
+    # In-memory user tables, one per guild this process owns, backed by the state
+    # backend. Reads never leave the process; every XP or level change is queued as
+    # a ledger event and flush_users appends them in one batch. The users table on
+    # disk is the last checkpoint of that ledger (see "XP ledger" below).
+    def __init__(self, backend):
+        self.backend = backend
+        self.guilds = {}  # guild_id -> {user_id: {"xp", "level", "name"}}
+        self.events = []  # (at, guild_id, user_id, kind, xp gained, level, detail) not yet appended
+        self.renamed = set()  # (guild_id, user_id) whose display name changed since the last flush
+        self.unsent = []  # (batch_id, events, names) whose write failed; resent with the same ID
+        # Batches must reach the ledger in order: events carry the absolute level after
+        # them, so a newer batch landing first would leave the older level on replay
+        self.flush_lock = asyncio.Lock()
+        self.loaded = False
+        self.listeners = []
+
+    def close(self):
+        if self.loaded:
+            self.flush()
+        self.backend.close()
+
+    def load(self):
+        self.backend.open()
+        self.guilds = {}
+        for guild_id, user_id, xp, level, name in self.backend.load_users(*owned_shard_filter()):
+            self.guilds.setdefault(guild_id, {})[user_id] = {"xp": xp, "level": level, "name": name}
+        self.events.clear()
+        self.renamed.clear()
+        self.unsent.clear()
+        self.loaded = True
+        for listener in self.listeners:
+            listener.rebuild(self)
+
+    def claim_legacy(self, guild_id):
+        # Moves pre-partition rows into guild_id in memory, after claim_legacy_rows
+        # did the same on disk; rows the guild already has keep their own progression.
+        guild_id = str(guild_id)
+        legacy = self.guilds.pop(LEGACY_GUILD_ID, {})
+        users = self.guilds.setdefault(guild_id, {})
+        for user_id, user_data in legacy.items():
+            users.setdefault(user_id, user_data)
+        if legacy:
+            for listener in self.listeners:
+                listener.rebuild(self)
+        return len(legacy)
+
+    def get(self, guild_id, user_id):
+        return self.guilds.get(str(guild_id), {}).get(str(user_id))
+
+    def get_or_create(self, guild_id, user_id):
+        guild_id, user_id = str(guild_id), str(user_id)
+        users = self.guilds.setdefault(guild_id, {})
+        user_data = users.get(user_id)
+        if user_data is None:
+            user_data = users[user_id] = {"xp": 0, "level": 0, "name": None}
+            self.notify(guild_id, user_id)
+        return user_data
+
+    def update(self, guild_id, user_id, kind="xp", detail=None, **fields):
+        # Applies fields and logs the XP/level change, if any, as one `kind` event
+        guild_id, user_id = str(guild_id), str(user_id)
+        user_data = self.get_or_create(guild_id, user_id)
+        gained = fields["xp"] - user_data["xp"] if "xp" in fields else 0
+        leveled = "level" in fields and fields["level"] != user_data["level"]
+        if "name" in fields and fields["name"] != user_data.get("name"):
+            self.renamed.add((guild_id, user_id))
+        user_data.update(fields)
+        if gained or leveled:
+            self.record(guild_id, user_id, kind, gained, user_data["level"], detail)
+            self.notify(guild_id, user_id)
+        return user_data
+
+    def record(self, guild_id, user_id, kind, xp=0, level=None, detail=None):
+        self.events.append((time.time(), str(guild_id), str(user_id), kind, xp, level, detail))
+
+    def notify(self, guild_id, user_id):
+        user_data = self.get(guild_id, user_id)
+        if user_data is not None:
+            for listener in self.listeners:
+                listener.update(str(guild_id), str(user_id), user_data["level"], user_data["xp"])
+
+    def __len__(self):
+        return sum(len(users) for users in self.guilds.values())
+
+    def items(self, guild_id):
+        return self.guilds.get(str(guild_id), {}).items()
+
+    def all_items(self):
+        for guild_id, users in self.guilds.items():
+            for user_id, user_data in users.items():
+                yield guild_id, user_id, user_data
+
+    def _take_pending(self):
+        # Seals pending changes into a new batch behind any that still await a write
+        if self.events or self.renamed:
+            names = [(guild_id, user_id, self.get(guild_id, user_id)["name"]) for guild_id, user_id in self.renamed
+                     if self.get(guild_id, user_id) is not None]
+            self.unsent.append((uuid.uuid4().hex, self.events, names))
+            self.events, self.renamed = [], set()
+        batches, self.unsent = self.unsent, []
+        return batches
+
+    def flush(self):
+        # Synchronous flush for shutdown and offline tools; defers to an async flush in flight
+        if not self.loaded or self.flush_lock.locked() or not (self.events or self.renamed or self.unsent):
+            return 0
+        batches = self._take_pending()
+        written = 0
+        for index, batch in enumerate(batches):
+            try:
+                self.backend.append_events(*batch)
+            except STORAGE_ERRORS:
+                # Keep the batch ID: the write may have landed before the error
+                self.unsent[:0] = batches[index:]
+                raise
+            written += len(batch[1])
+        return written
+
+    async def flush_async(self):
+        # Pending events are drained on the event loop; only the writes run in a thread.
+        async with self.flush_lock:
+            if not self.loaded or not (self.events or self.renamed or self.unsent):
+                return 0
+            batches = self._take_pending()
+            written = 0
+            for index, batch in enumerate(batches):
+                try:
+                    await asyncio.to_thread(self.backend.append_events, *batch)
+                except STORAGE_ERRORS as e:
+                    self.unsent[:0] = batches[index:]
+                    metrics.inc("bloodbun_storage_errors_total", op="flush")
+                    print(f"Error flushing user data: {e}")
+                    return written
+                written += len(batch[1])
+            return written
+
+RANK_CHUNK = 1000  # keys per RankIndex chunk; chunks split at twice this
+
+class RankIndex:
+    # Sorted (-level, -xp, user_id) keys kept in chunks of at most 2 * RANK_CHUNK,
+    # with each chunk's largest key and a Fenwick tree of chunk sizes. An update
+    # bisects to its chunk and shifts only that chunk; rank and slice start are
+    # Fenwick prefix sums. Both are O(log n) plus a shift bounded by the chunk size.
+    def __init__(self):
+        self.chunks = []
+        self.maxes = []
+        self.tree = [0]
+        self.size = 0
+        self.by_user = {}
+        self.version = 0
+
+    def __len__(self):
+        return self.size
+
+    def rebuild(self, items):
+        self.by_user = {user_id: (-user_data["level"], -user_data["xp"], user_id) for user_id, user_data in items}
+        keys = sorted(self.by_user.values())
+        self.chunks = [keys[i:i + RANK_CHUNK] for i in range(0, len(keys), RANK_CHUNK)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.size = len(keys)
+        self._rebuild_tree()
+        self.version += 1
+
+    def _rebuild_tree(self):
+        # Only after chunks are split or dropped, i.e. once per RANK_CHUNK changes at most
+        tree = [0] + [len(chunk) for chunk in self.chunks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def _add(self, chunk_index, delta):
+        i = chunk_index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _before(self, chunk_index):
+        # Number of keys in chunks before chunk_index
+        total, i = 0, chunk_index
+        while i:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, position):
+        # (chunk index, offset) of the 0-based position
+        index, step = 0, 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = index + step
+            if nxt < len(self.tree) and self.tree[nxt] <= position:
+                index = nxt
+                position -= self.tree[nxt]
+            step >>= 1
+        return index, position
+
+    def _insert(self, key):
+        if not self.chunks:
+            self.chunks, self.maxes = [[key]], [key]
+            self._rebuild_tree()
+            return
+        chunk_index = min(bisect_left(self.maxes, key), len(self.chunks) - 1)
+        chunk = self.chunks[chunk_index]
+        insort(chunk, key)
+        self.maxes[chunk_index] = chunk[-1]
+        if len(chunk) > 2 * RANK_CHUNK:
+            self.chunks[chunk_index:chunk_index + 1] = [chunk[:RANK_CHUNK], chunk[RANK_CHUNK:]]
+            self.maxes[chunk_index:chunk_index + 1] = [chunk[RANK_CHUNK - 1], chunk[-1]]
+            self._rebuild_tree()
+        else:
+            self._add(chunk_index, 1)
+
+    def _remove(self, key):
+        chunk_index = bisect_left(self.maxes, key)
+        chunk = self.chunks[chunk_index]
+        del chunk[bisect_left(chunk, key)]
+        if chunk:
+            self.maxes[chunk_index] = chunk[-1]
+            self._add(chunk_index, -1)
+        else:
+            del self.chunks[chunk_index], self.maxes[chunk_index]
+            self._rebuild_tree()
+
+    def update(self, user_id, level, xp):
+        key = (-level, -xp, user_id)
+        old = self.by_user.get(user_id)
+        if old == key:
+            return
+        if old is not None:
+            self._remove(old)
+            self.size -= 1
+        self._insert(key)
+        self.size += 1
+        self.by_user[user_id] = key
+        self.version += 1
+
+    def rank(self, user_id):
+        key = self.by_user.get(str(user_id))
+        if not key:
+            return None
+        chunk_index = bisect_left(self.maxes, key)
+        return self._before(chunk_index) + bisect_left(self.chunks[chunk_index], key) + 1
+
+    def slice(self, start, stop):
+        start, stop = max(start, 0), min(stop, self.size)
+        rows = []
+        if start >= stop:
+            return rows
+        chunk_index, offset = self._find(start)
+        rank = start + 1
+        while rank <= stop:
+            for neg_level, neg_xp, user_id in self.chunks[chunk_index][offset:offset + stop - rank + 1]:
+                rows.append((rank, user_id, -neg_level, -neg_xp))
+                rank += 1
+            chunk_index, offset = chunk_index + 1, 0
+        return rows
+
+    def page(self, page, size=10):
+        return self.slice((page - 1) * size, page * size)
+
+    def around(self, user_id, radius=2):
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        return self.slice(rank - 1 - radius, rank + radius)
+
+class LeaderboardIndexes:
+    # One RankIndex per guild, kept current as a UserStore listener
+    def __init__(self):
+        self.indexes = {}  # guild_id -> RankIndex
+
+    def get(self, guild_id):
+        guild_id = str(guild_id)
+        index = self.indexes.get(guild_id)
+        if index is None:
+            index = self.indexes[guild_id] = RankIndex()
+        return index
+
+    def rebuild(self, store):
+        # Existing indexes are rebuilt in place so their versions keep increasing
+        for guild_id in set(self.indexes) | set(store.guilds):
+            self.get(guild_id).rebuild(store.items(guild_id))
+
+    def update(self, guild_id, user_id, level, xp):
+        self.get(guild_id).update(user_id, level, xp)
+
+user_store = UserStore(state_backend)
+leaderboards = LeaderboardIndexes()
+user_store.listeners.append(leaderboards)
+
+async def flush_cooldowns():
+    if not user_store.loaded or not cooldown_service.persist_dirty:
+        return
+    cooldown_service.persist_dirty = False
+    try:
+        await asyncio.to_thread(state_backend.save_cooldowns, cooldown_service.persistent_rows())
+    except STORAGE_ERRORS as e:
+        cooldown_service.persist_dirty = True
+        print(f"Error saving cooldowns: {e}")
+
+@tasks.loop(seconds=FLUSH_INTERVAL)
+async def flush_users():
+    with metrics.timer("bloodbun_storage_seconds", op="flush"):
+        written = await user_store.flush_async()
+    metrics.inc("bloodbun_storage_rows_written_total", written)
+    metrics.set("bloodbun_users", len(user_store))
+    await whisper_store.flush_async()
+    await flush_cooldowns()
+
+# XP ledger
+# Every XP grant, level change and path choice/reset is appended to xp_events.
+# maintain_ledger folds new events into the users table (the checkpoint), archives
+# a compressed snapshot of it every LEDGER_SNAPSHOT_INTERVAL, and deletes events
+# older than the oldest kept snapshot. Startup loads the checkpoint and replays the
+# tail; !xprewind rebuilds a guild from the nearest snapshot plus events up to then.
+LEDGER_CHECKPOINT_INTERVAL = 600  # seconds
+LEDGER_SNAPSHOT_INTERVAL = 6 * 3600  # seconds
+LEDGER_SNAPSHOTS_KEPT = 28  # one week at the default interval
+LEDGER_LOG_LINES = 10
+
+async def checkpoint_ledger():
+    if not user_store.loaded:
+        return
+    try:
+        with metrics.timer("bloodbun_storage_seconds", op="checkpoint"):
+            folded = await asyncio.to_thread(state_backend.checkpoint)
+            if await asyncio.to_thread(state_backend.snapshot_if_due, LEDGER_SNAPSHOT_INTERVAL):
+                await asyncio.to_thread(state_backend.compact_ledger, LEDGER_SNAPSHOTS_KEPT)
+    except STORAGE_ERRORS as e:
+        metrics.inc("bloodbun_storage_errors_total", op="checkpoint")
+        print(f"Error checkpointing XP ledger: {e}")
+        return
+    metrics.inc("bloodbun_ledger_events_checkpointed_total", folded)
+
+@tasks.loop(seconds=LEDGER_CHECKPOINT_INTERVAL)
+async def maintain_ledger():
+    await user_store.flush_async()
+    await checkpoint_ledger()
+
+# Background tasks
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Outbound messages
+# Event handlers enqueue sends and return. Each channel with pending output gets
+# one worker that drains its queue in order, merging consecutive plain-text
+# messages into a single send when they fit, and retrying 429/5xx with backoff.
+OUTBOUND_MAX_LENGTH = 2000
+OUTBOUND_RETRIES = 3
+OUTBOUND_BACKOFF = 1.0  # seconds, doubled per attempt
+REACTION_CONCURRENCY = 3
+
+class OutboundDispatcher:
+    def __init__(self):
+        self.queues = {}  # channel_id -> deque of (content, kwargs)
+        self.workers = {}  # channel_id -> Task
+        self.reaction_slots = None
+
+    def send(self, channel, content=None, **kwargs):
+        queue = self.queues.setdefault(channel.id, deque())
+        queue.append((content, kwargs))
+        if channel.id not in self.workers:
+            self.workers[channel.id] = spawn(self._drain(channel))
+
+    def react(self, message, emojis):
+        spawn(self._react(message, list(dict.fromkeys(emojis))))
+
+    async def _drain(self, channel):
+        queue = self.queues[channel.id]
+        try:
+            while queue:
+                content, kwargs = queue.popleft()
+                if content and not kwargs:
+                    while (
+                        queue and queue[0][0] and not queue[0][1]
+                        and len(content) + 1 + len(queue[0][0]) <= OUTBOUND_MAX_LENGTH
+                    ):
+                        content += "\n" + queue.popleft()[0]
+                await self.with_retry("send", channel.send, content, **kwargs)
+        finally:
+            self.workers.pop(channel.id, None)
+            if not queue:
+                self.queues.pop(channel.id, None)
+
+    async def _react(self, message, emojis):
+        if self.reaction_slots is None:
+            self.reaction_slots = asyncio.Semaphore(REACTION_CONCURRENCY)
+
+        async def add(emoji):
+            async with self.reaction_slots:
+                await self.with_retry("reaction", message.add_reaction, emoji)
+
+        await asyncio.gather(*(add(emoji) for emoji in emojis))
+
+    async def with_retry(self, kind, call, *args, **kwargs):
+        for attempt in range(OUTBOUND_RETRIES + 1):
+            try:
+                return await call(*args, **kwargs)
+            except discord.HTTPException as e:
+                if (e.status == 429 or e.status >= 500) and attempt < OUTBOUND_RETRIES:
+                    await asyncio.sleep(OUTBOUND_BACKOFF * 2 ** attempt * random.uniform(1, 1.5))
+                    continue
+                metrics.inc("bloodbun_outbound_errors_total", kind=kind, status=e.status)
+                print(f"Error delivering {kind}: {e}")
+                return None
+
+outbound = OutboundDispatcher()
+
+# XP accrual
+# on_message only touches the cooldown and pending_xp dicts; flush_xp folds the
+# accumulated deltas into the user table and schedules level-up announcements.
+pending_xp = {}  # (guild_id, user_id) -> [xp gained, channel_id of latest message]
+
+def accrue_message_xp(message):
+    key = (str(message.guild.id), str(message.author.id))
+    if cooldown_service.hit("xp", guild_key(*key)):
+        return False
+
+    gained = random.randint(MIN_XP, MAX_XP)
+    entry = pending_xp.get(key)
+    if entry is None:
+        pending_xp[key] = [gained, message.channel.id]
+    else:
+        entry[0] += gained
+        entry[1] = message.channel.id
+    return True
+
+def apply_pending_xp(announce=True):
+    global pending_xp
+    if not pending_xp:
+        return 0
+    batch, pending_xp = pending_xp, {}
+    for (guild_id, user_id), (gained, channel_id) in batch.items():
+        user_data = user_store.get_or_create(guild_id, user_id)
+        old_level = user_data["level"]
+        xp = user_data["xp"] + gained
+        # Never demote on chat; drifted levels are fixed by an explicit recompute
+        level = max(old_level, get_level_from_xp(xp, xp_table))
+        user_store.update(guild_id, user_id, xp=xp, level=level)
+        if announce and level > old_level:
+            spawn(announce_level_up(guild_id, user_id, channel_id, old_level, level))
+    return len(batch)
+
+@tasks.loop(seconds=XP_FLUSH_INTERVAL)
+async def flush_xp():
+    apply_pending_xp()
+
+def level_role_names(level):
+    names = {name for lvl, name in level_roles.items() if level >= lvl}
+    if level >= max(xp_table):
+        names.add(final_role)
+    return names
+
+async def announce_level_up(guild_id, user_id, channel_id, old_level, new_level):
+    guild = bot.get_guild(int(guild_id))
+    channel = bot.get_channel(channel_id)
+    member = get_member(guild, user_id) if guild else None
+    if member is None or channel is None:
+        return
+
+    lines = [f"✨ {member.mention} has reached **Level {new_level}**!"]
+    crossed = range(old_level + 1, new_level + 1)
+    lines += [level_messages[lvl] for lvl in crossed if lvl in level_messages]
+    path = role_registry.member_path(member)
+    if path:
+        lines += [path_lore[path][lvl] for lvl in crossed if lvl in path_lore[path]]
+    if old_level < max(xp_table) <= new_level:
+        lines.append(final_message)
+
+    try:
+        missing = [
+            role for role in (role_registry.get(guild, name) for name in level_role_names(new_level))
+            if role and member.get_role(role.id) is None
+        ]
+        if missing:
+            await member.add_roles(*missing, reason=f"Reached level {new_level}")
+    except discord.HTTPException as e:
+        print(f"Error awarding level roles: {e}")
+
+    outbound.send(channel, "\n\n".join(lines))
+
+@bot.hybrid_command(name="stats", description="Check your level and XP.")
+@commands.guild_only()
 async def check_stats(ctx):
-    user_id = str(ctx.author.id)
-    data = load_data()
+    user_data = user_store.get(ctx.guild.id, ctx.author.id)
 
-    if user_id not in data:
-        await ctx.send("🌌 You haven't earned any XP yet. Start chatting to gain experience!")
+    if user_data is None:
+        await ctx.send("🌌 You haven't earned any XP yet. Start chatting to gain experience!", ephemeral=True)
         return
 
-    user_data = data[user_id]
     xp = user_data["xp"]
     level = user_data["level"]
 
@@ -156,90 +1747,196 @@ async def check_stats(ctx):
     await ctx.send(f"🌟 **{ctx.author.display_name}'s Realm Stats**\n"
                    f"Level: {level}\n"
                    f"XP: {xp}\n"
-                   f"Next: {xp_needed}")
+                   f"Next: {xp_needed}", ephemeral=True)
 
-@bot.command(name="choose")
+@bot.hybrid_command(name="choose", description="Choose your path at level 20.")
+@commands.guild_only()
+@per_user_lock
 async def choose_path(ctx, path: Optional[str] = None):
     if not path:
         await ctx.send("🌌 Choose your path: `!choose flame` 🔥  |  `!choose ash` 🪶  |  `!choose echo` 🌀")
         return
 
-    user_id = str(ctx.author.id)
-    data = load_data()
+    user_data = user_store.get(ctx.guild.id, ctx.author.id)
 
-    if user_id not in data or data[user_id]["level"] < 20:
+    if user_data is None or user_data["level"] < PATH_MIN_LEVEL:
         await ctx.send("🌌 You must reach level 20 before choosing a path.")
         return
 
+    await ctx.defer()
     path = path.lower()
     if path not in path_roles:
         await ctx.send("🌌 Unknown path. Choose: `flame`, `ash`, or `echo`")
         return
 
-    user_roles = [role.name for role in ctx.author.roles]
-    for path_data in path_roles.values():
-        if path_data["role"] in user_roles:
-            await ctx.send("🌌 You have already chosen your path and cannot change it.")
-            return
+    # ctx.author's roles are a snapshot that add_roles doesn't update, so a choice
+    # made moments ago is only visible in the user record (in memory; roles stay
+    # the durable record)
+    if user_data.get("path") or role_registry.member_path(ctx.author):
+        await ctx.send("🌌 You have already chosen your path and cannot change it.")
+        return
 
     path_info = path_roles[path]
-    role = discord.utils.get(ctx.guild.roles, name=path_info["role"])
+    role = role_registry.get(ctx.guild, path_info["role"])
     if role:
         await ctx.author.add_roles(role)
+        user_data["path"] = path
+        user_store.record(ctx.guild.id, ctx.author.id, "path", detail=path)
         await ctx.send(path_info["message"])
     else:
         await ctx.send(f"🌌 The {path_info['role']} role doesn't exist on this server.")
 
-@bot.command(name="leaderboard")
-async def leaderboard(ctx):
-        data = load_data()
-        if not data:
+# Member cache
+# In lean mode members come from a bounded LRU filled by message authors; anyone
+# else is resolved through the display-name cache stored with their user record,
+# then through batched member queries of up to 100 IDs.
+MEMBER_LRU_SIZE = int(os.getenv("BLOODBUN_MEMBER_LRU", "5000"))
+MEMBER_QUERY_BATCH = 100
+
+class MemberLRU:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.members = OrderedDict()  # (guild_id, user_id) -> Member
+
+    def __len__(self):
+        return len(self.members)
+
+    def put(self, member):
+        key = (member.guild.id, member.id)
+        self.members[key] = member
+        self.members.move_to_end(key)
+        if len(self.members) > self.capacity:
+            self.members.popitem(last=False)
+
+    def get(self, guild_id, user_id):
+        member = self.members.get((guild_id, user_id))
+        if member is not None:
+            self.members.move_to_end((guild_id, user_id))
+        return member
+
+member_lru = MemberLRU(MEMBER_LRU_SIZE)
+
+def remember_member(member):
+    if LEAN_MEMBERS:
+        member_lru.put(member)
+    user_data = user_store.get(member.guild.id, member.id)
+    if user_data is not None and user_data.get("name") != member.display_name:
+        user_store.update(member.guild.id, member.id, name=member.display_name)
+
+def get_member(guild, user_id):
+    user_id = int(user_id)
+    return guild.get_member(user_id) or member_lru.get(guild.id, user_id)
+
+async def query_members(guild, user_ids):
+    found = {}
+    user_ids = [int(user_id) for user_id in user_ids]
+    for start in range(0, len(user_ids), MEMBER_QUERY_BATCH):
+        batch = user_ids[start:start + MEMBER_QUERY_BATCH]
+        try:
+            members = await guild.query_members(user_ids=batch, limit=len(batch), cache=False)
+        except (discord.HTTPException, asyncio.TimeoutError) as e:
+            print(f"Error querying members: {e}")
+            continue
+        for member in members:
+            found[str(member.id)] = member
+            remember_member(member)
+    return found
+
+async def resolve_member_names(guild, user_ids):
+    names, missing = {}, []
+    for user_id in user_ids:
+        member = get_member(guild, user_id)
+        cached = (user_store.get(guild.id, user_id) or {}).get("name")
+        if member is not None:
+            names[user_id] = member.display_name
+        elif cached:
+            names[user_id] = cached
+        else:
+            missing.append(user_id)
+    if missing:
+        for user_id, member in (await query_members(guild, missing)).items():
+            names[user_id] = member.display_name
+    return names
+
+LEADERBOARD_PAGE_SIZE = 10
+leaderboard_cache = {}  # (guild_id, page) -> (RankIndex.version, text)
+
+async def render_rank_lines(guild, entries, highlight=None):
+    names = await resolve_member_names(guild, [user_id for _, user_id, _, _ in entries])
+    lines = []
+    for rank, user_id, level, xp in entries:
+        name = names.get(user_id, f"User {user_id}")
+        marker = "➤ " if user_id == highlight else ""
+        lines.append(f"{marker}{rank}. {name} — Level {level} ({xp} XP)")
+    return "\n".join(lines)
+
+@bot.hybrid_command(name="leaderboard", description="See the top Realmbound souls.")
+@commands.guild_only()
+async def leaderboard(ctx, page: int = 1):
+        await ctx.defer()
+        rank_index = leaderboards.get(ctx.guild.id)
+        if not len(rank_index):
             await ctx.send("🌌 No one has earned XP yet!")
             return
-        sorted_users = sorted(
-            data.items(),
-            key=lambda x: (-int(x[1].get("level", 0)), -int(x[1].get("xp", 0)))
-        )[:10]
+        pages = (len(rank_index) + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE
+        page = min(max(page, 1), pages)
+
+        cache_key = (ctx.guild.id, page)
+        cached = leaderboard_cache.get(cache_key)
+        if cached and cached[0] == rank_index.version:
+            await ctx.send(cached[1])
+            return
 
+        # Tag the entry with the version the rows were read at; ranks may move
+        # while render_rank_lines waits on a member query
+        version, rows = rank_index.version, rank_index.page(page, LEADERBOARD_PAGE_SIZE)
         leaderboard_text = "🏆 **The Realm's Top Dwellers**\n"
-        for i, (user_id, user_data) in enumerate(sorted_users, 1):
-            member = ctx.guild.get_member(int(user_id))
-            name = member.display_name if member else f"User {user_id}"
-            leaderboard_text += f"{i}. {name} — Level {user_data['level']} ({user_data['xp']} XP)\n"
+        leaderboard_text += await render_rank_lines(ctx.guild, rows) + "\n"
+        if pages > 1:
+            leaderboard_text += f"_Page {page}/{pages} — `!leaderboard <page>`_\n"
 
+        leaderboard_cache[cache_key] = (version, leaderboard_text)
         await ctx.send(leaderboard_text)
 
-@bot.command(name="realmpath")
-async def realmpath(ctx):
-    user_roles = [role.name for role in ctx.author.roles]
-    current_path = None
+@bot.hybrid_command(name="rank", description="See where you stand among your neighbours.")
+@commands.guild_only()
+async def rank(ctx, member: Optional[discord.Member] = None):
+    member = member or ctx.author
+    user_id = str(member.id)
+    rank_index = leaderboards.get(ctx.guild.id)
+    position = rank_index.rank(user_id)
+    if position is None:
+        await ctx.send(f"🌌 {member.display_name} hasn't earned any XP yet.", ephemeral=True)
+        return
 
-    for path_key, path_data in path_roles.items():
-        if path_data["role"] in user_roles:
-            current_path = path_key
-            break
+    await ctx.defer(ephemeral=True)
+    await ctx.send(f"🏆 **{member.display_name}** stands at **#{position}** of {len(rank_index)} in the Realm\n"
+                   f"{await render_rank_lines(ctx.guild, rank_index.around(user_id), highlight=user_id)}", ephemeral=True)
+
+@bot.hybrid_command(name="realmpath", description="View your current path and next lore milestone.")
+@commands.guild_only()
+async def realmpath(ctx):
+    current_path = role_registry.member_path(ctx.author)
 
     if not current_path:
-        await ctx.send(f"{ctx.author.mention}, you have not chosen a path yet. Reach level 20 and use `!choose`.")
+        await ctx.send(f"{ctx.author.mention}, you have not chosen a path yet. Reach level 20 and use `!choose`.", ephemeral=True)
         return
 
-    data = load_data()
-    user_id = str(ctx.author.id)
-    level = data.get(user_id, {}).get("level", 0)
+    level = (user_store.get(ctx.guild.id, ctx.author.id) or {}).get("level", 0)
 
     next_milestone = next((lvl for lvl in sorted(path_lore[current_path]) if lvl > level), None)
     if next_milestone:
-        await ctx.send(f"{ctx.author.mention}, you walk the **Path of {path_roles[current_path]['role']}** {path_roles[current_path]['symbol']}\nNext revelation awaits at **Level {next_milestone}**.")
+        await ctx.send(f"{ctx.author.mention}, you walk the **Path of {path_roles[current_path]['role']}** {path_roles[current_path]['symbol']}\nNext revelation awaits at **Level {next_milestone}**.", ephemeral=True)
     else:
-        await ctx.send(f"{ctx.author.mention}, you walk the **Path of {path_roles[current_path]['role']}** {path_roles[current_path]['symbol']}\nYou have received all known revelations. The Realm watches in silence...")
+        await ctx.send(f"{ctx.author.mention}, you walk the **Path of {path_roles[current_path]['role']}** {path_roles[current_path]['symbol']}\nYou have received all known revelations. The Realm watches in silence...", ephemeral=True)
 
-@bot.command(name="resetpath")
+@bot.hybrid_command(name="resetpath", description="Abandon your current path (once every 24h).")
+@commands.guild_only()
 async def resetpath(ctx):
-    user_id = str(ctx.author.id)
-    now = time.time()
+    cooldown_key = guild_key(ctx.guild.id, ctx.author.id)
 
-    if user_id in reset_cooldowns and now - reset_cooldowns[user_id] < RESET_COOLDOWN_SECONDS:
-        remaining = int(RESET_COOLDOWN_SECONDS - (now - reset_cooldowns[user_id]))
+    remaining = int(cooldown_service.retry_after("resetpath", cooldown_key))
+    if remaining:
         hours = remaining // 3600
         minutes = (remaining % 3600) // 60
         await ctx.send(f"{ctx.author.mention}, you may only reset your path once every 24 hours.\nTry again in **{hours}h {minutes}m**.")
@@ -253,14 +1950,17 @@ async def resetpath(ctx):
     try:
         msg = await bot.wait_for("message", check=check, timeout=30)
         if msg.content.lower() == "yes":
-            removed = False
-            for path_data in path_roles.values():
-                role = discord.utils.get(ctx.guild.roles, name=path_data["role"])
-                if role in ctx.author.roles:
-                    await ctx.author.remove_roles(role)
-                    removed = True
-            if removed:
-                reset_cooldowns[user_id] = now
+            user_data = user_store.get(ctx.guild.id, ctx.author.id) or {}
+            held = role_registry.member_path_roles(ctx.author)
+            if not held and user_data.get("path"):
+                # Chosen moments ago; the local member hasn't seen the role yet
+                role = role_registry.get(ctx.guild, path_roles[user_data["path"]]["role"])
+                held = [role] if role else []
+            if held:
+                await ctx.author.remove_roles(*held)
+                user_data.pop("path", None)
+                cooldown_service.hit("resetpath", cooldown_key)
+                user_store.record(ctx.guild.id, ctx.author.id, "path_reset", detail=",".join(role.name for role in held))
                 await ctx.send(f"{ctx.author.mention}, your path has been severed. The Realm forgets... for now.")
             else:
                 await ctx.send("You are not bound to any path.")
@@ -269,7 +1969,277 @@ async def resetpath(ctx):
     except asyncio.TimeoutError:
         await ctx.send("No response. Path reset cancelled.")
 
-@bot.command(name="realmhelp")
+@bot.hybrid_command(name="recalclevels", description="Recompute every level from the current XP curve.")
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def recalclevels(ctx):
+    await ctx.defer()
+    apply_pending_xp(announce=False)
+    changed = recompute_levels(user_store, xp_table)
+    await user_store.flush_async()
+    await state_backend.publish({"kind": "recompute_levels"})
+    await ctx.send(f"🌌 Recomputed levels for {len(user_store)} soul(s); {changed} record(s) corrected.")
+
+@bot.hybrid_command(name="xplog", description="Show a member's recent XP ledger entries.")
+@commands.guild_only()
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def xplog(ctx, member: Optional[discord.Member] = None):
+    member = member or ctx.author
+    await ctx.defer(ephemeral=True)
+    apply_pending_xp(announce=False)
+    await user_store.flush_async()
+    events = await asyncio.to_thread(state_backend.load_events, ctx.guild.id, member.id, LEDGER_LOG_LINES)
+    if not events:
+        await ctx.send(f"📜 No ledger entries for {member.display_name}.", ephemeral=True)
+        return
+
+    lines = [f"📜 **Ledger for {member.display_name}** (newest first)"]
+    for at, kind, xp, level, detail in events:
+        change = f"{xp:+} XP" if xp else ""
+        if level is not None:
+            change = f"{change} → level {level}".strip()
+        lines.append(f"<t:{int(at)}:R> `{kind}` {change} {detail or ''}".rstrip())
+    await ctx.send("\n".join(lines), ephemeral=True)
+
+@bot.hybrid_command(name="xprewind", description="Rewind progression to how it stood some hours ago.")
+@commands.guild_only()
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def xprewind(ctx, hours: float, member: Optional[discord.Member] = None):
+    if hours <= 0:
+        await ctx.send("⏳ Usage: `!xprewind <hours> [member]`")
+        return
+    await ctx.defer()
+    at = time.time() - hours * 3600
+    apply_pending_xp(announce=False)
+    await user_store.flush_async()
+    try:
+        rebuilt = await asyncio.to_thread(state_backend.rebuild_users, ctx.guild.id, at)
+    except STORAGE_ERRORS as e:
+        await ctx.send(f"⏳ Could not read the XP ledger: {e}")
+        return
+    if rebuilt is None:
+        await ctx.send("⏳ The ledger doesn't reach back that far.")
+        return
+
+    user_ids = [str(member.id)] if member else [user_id for user_id, _ in user_store.items(ctx.guild.id)]
+    changes = {}
+    for user_id in user_ids:
+        user_data = user_store.get(ctx.guild.id, user_id) or {"xp": 0, "level": 0}
+        xp, level = rebuilt.get(user_id, (0, 0))
+        if (xp, level) != (user_data["xp"], user_data["level"]):
+            changes[user_id] = (xp, level)
+    if not changes:
+        await ctx.send(f"⏳ Nothing changed since <t:{int(at)}:f>.")
+        return
+
+    def check(m):
+        return m.author == ctx.author and m.channel == ctx.channel
+
+    await ctx.send(f"⏳ Rewind {len(changes)} soul(s) to their progression at <t:{int(at)}:f>? Type `yes` to confirm.")
+    try:
+        msg = await bot.wait_for("message", check=check, timeout=30)
+    except asyncio.TimeoutError:
+        await ctx.send("No response. Rewind cancelled.")
+        return
+    if msg.content.lower() != "yes":
+        await ctx.send("Rewind cancelled.")
+        return
+
+    for user_id, (xp, level) in changes.items():
+        user_store.update(ctx.guild.id, user_id, kind="rewind", detail=str(int(at)), xp=xp, level=level)
+    await user_store.flush_async()
+    await ctx.send(f"⏳ Rewound {len(changes)} soul(s). Roles catch up on the next `!reconcileroles`.")
+
+# Role reconciliation
+# Brings level, final and path roles in line with stored progression. Members are
+# processed in chunks of RECONCILE_CHUNK; each chunk is fetched with one member
+# query, diffed, and applied by a bounded pool with one edit(roles=...) per member.
+# The last finished user ID is saved after every chunk so a job can resume.
+RECONCILE_CHUNK = 100
+RECONCILE_WORKERS = 4
+cooldown_service.add_policy("role_edit", TokenBucket(5, 1.0))
+reconcile_jobs = {}  # guild_id -> RoleReconcileJob
+
+def role_diff(member, level):
+    guild = member.guild
+    desired = level_role_names(level)
+    add, remove = [], []
+    for name in set(level_roles.values()) | {final_role}:
+        role = role_registry.get(guild, name)
+        if role is None:
+            continue
+        held = member.get_role(role.id) is not None
+        if name in desired and not held:
+            add.append(role)
+        elif name not in desired and held:
+            remove.append(role)
+    if level < PATH_MIN_LEVEL:
+        remove += role_registry.member_path_roles(member)
+    return add, remove
+
+class RoleReconcileJob:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+        self.cursor_key = f"reconcile_cursor:{guild.id}"
+        self.checked = self.changed = self.failed = 0
+        self.total = 0
+        self.done = False
+        self.error = None
+        self.task = None
+        self.status_message = None
+
+    def status(self):
+        if self.error is not None:
+            state = f"failed ({self.error}; `!reconcileroles` resumes)"
+        else:
+            state = "finished" if self.done else "cancelled" if self.task and self.task.cancelled() else "running"
+        return (f"⚖️ Role reconciliation {state}: {self.checked}/{self.total} checked, "
+                f"{self.changed} updated, {self.failed} failed.")
+
+    async def report(self):
+        try:
+            if self.status_message is None:
+                self.status_message = await self.channel.send(self.status())
+            else:
+                try:
+                    await self.status_message.edit(content=self.status())
+                except discord.HTTPException as e:
+                    # A slash-command reply stops being editable once its token expires (15 min)
+                    print(f"Status message not editable, posting a new one: {e}")
+                    self.status_message = await self.channel.send(self.status())
+        except discord.HTTPException as e:
+            print(f"Error reporting reconciliation progress: {e}")
+
+    async def fetch_members(self, user_ids):
+        members = {}
+        missing = []
+        for user_id in user_ids:
+            member = get_member(self.guild, user_id)
+            if member:
+                members[user_id] = member
+            else:
+                missing.append(user_id)
+        if missing:
+            members.update(await query_members(self.guild, missing))
+        return members
+
+    async def apply(self, member, level):
+        add, remove = role_diff(member, level)
+        if not add and not remove:
+            return
+        roles = [role for role in member.roles if not role.is_default() and role not in remove] + add
+        await cooldown_service.acquire("role_edit", self.guild.id)
+        try:
+            await member.edit(roles=roles, reason="Role reconciliation")
+            self.changed += 1
+        except discord.HTTPException as e:
+            self.failed += 1
+            print(f"Error reconciling roles for {member.id}: {e}")
+
+    async def run(self, restart=False):
+        # Nobody awaits the task, so a failure has to be recorded and reported here
+        try:
+            await self._run(restart)
+        except Exception as e:
+            self.error = e
+            metrics.inc("bloodbun_handler_errors_total", handler="reconcile_roles")
+            print(f"Role reconciliation failed in {self.guild.name}: {e!r}")
+            await self.report()
+
+    async def _run(self, restart):
+        if restart:
+            await asyncio.to_thread(state_backend.set_meta, self.cursor_key, "")
+        last_done = await asyncio.to_thread(state_backend.get_meta, self.cursor_key, "")
+        user_ids = sorted(user_id for user_id, _ in user_store.items(self.guild.id))
+        start = bisect_right(user_ids, last_done) if last_done else 0
+        self.total = len(user_ids)
+        self.checked = start
+        await self.report()
+
+        pool = asyncio.Semaphore(RECONCILE_WORKERS)
+
+        async def reconcile(member, level):
+            async with pool:
+                await self.apply(member, level)
+
+        for index in range(start, len(user_ids), RECONCILE_CHUNK):
+            chunk = user_ids[index:index + RECONCILE_CHUNK]
+            members = await self.fetch_members(chunk)
+            await asyncio.gather(*(
+                reconcile(member, (user_store.get(self.guild.id, user_id) or {}).get("level", 0))
+                for user_id, member in members.items()
+            ))
+            self.checked += len(chunk)
+            await asyncio.to_thread(state_backend.set_meta, self.cursor_key, chunk[-1])
+            await self.report()
+
+        self.done = True
+        await asyncio.to_thread(state_backend.set_meta, self.cursor_key, "")
+        await self.report()
+
+@bot.hybrid_command(name="reconcileroles", description="Bring level, final and path roles in line with stored progression.")
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def reconcileroles(ctx, action: str = "start"):
+    job = reconcile_jobs.get(ctx.guild.id)
+    running = job is not None and job.task is not None and not job.task.done()
+    action = action.lower()
+
+    if action == "status":
+        await ctx.send(job.status() if job else "⚖️ No reconciliation has run since startup.")
+    elif action == "cancel":
+        if running:
+            job.task.cancel()
+            await ctx.send("⚖️ Reconciliation paused. Use `!reconcileroles` to resume.")
+        else:
+            await ctx.send("⚖️ No reconciliation is running.")
+    elif action in ("start", "resume", "restart"):
+        if running:
+            await ctx.send(job.status())
+            return
+        job = reconcile_jobs[ctx.guild.id] = RoleReconcileJob(ctx.guild, ctx.channel)
+        # The first status goes through ctx so a slash invocation is answered
+        job.status_message = await ctx.send(job.status())
+        job.task = spawn(job.run(restart=action == "restart"))
+    else:
+        await ctx.send("⚖️ Usage: `!reconcileroles [start|status|cancel|restart]`")
+
+@bot.hybrid_command(name="botstats", description="Show BloodBun's vital signs.")
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def botstats(ctx):
+    def ms(seconds):
+        return "∞" if math.isinf(seconds) else f"{seconds * 1000:.1f}ms"
+
+    def summary(name):
+        histogram = metrics.merged(name)
+        return f"{histogram.count} × p50 ≤{ms(histogram.quantile(0.5))} p99 ≤{ms(histogram.quantile(0.99))}"
+
+    connected, latency = gateway_status()
+    slowest = sorted(
+        ((labels, histogram) for labels, histogram in metrics.histograms.get("bloodbun_command_seconds", {}).items()),
+        key=lambda item: -item[1].quantile(0.99)
+    )[:5]
+    lines = [
+        "📊 **BloodBun Vital Signs**",
+        f"Gateway: {'connected' if connected else 'DOWN'} ({ms(latency) if math.isfinite(latency) else 'n/a'})",
+        f"on_message: {summary('bloodbun_on_message_seconds')}",
+        f"Commands: {summary('bloodbun_command_seconds')}",
+        f"Discord API: {summary('bloodbun_discord_api_seconds')}, {metrics.total('bloodbun_discord_api_errors_total')} error(s)",
+        f"Storage: {summary('bloodbun_storage_seconds')}",
+        f"Loop lag: {summary('bloodbun_event_loop_lag_seconds')}",
+        f"Triggers fired: {metrics.total('bloodbun_triggers_total')}, handler errors: {metrics.total('bloodbun_handler_errors_total')}",
+    ]
+    if slowest:
+        lines.append("Slowest commands (p99): " + ", ".join(
+            f"`{dict(labels)['command']}` ≤{ms(histogram.quantile(0.99))}" for labels, histogram in slowest
+        ))
+    await ctx.send("\n".join(lines))
+
+@bot.hybrid_command(name="realmhelp", description="List the Realmbound commands.")
 async def realmhelp(ctx):
     embed = discord.Embed(
         title="📖 Realmbound Commands",
@@ -277,102 +2247,331 @@ async def realmhelp(ctx):
         color=discord.Color.dark_purple()
     )
     embed.add_field(name="!stats", value="Check your level and XP.", inline=False)
-    embed.add_field(name="!leaderboard", value="See the top Realmbound souls.", inline=False)
+    embed.add_field(name="!leaderboard [page]", value="See the top Realmbound souls.", inline=False)
+    embed.add_field(name="!rank [member]", value="See where you stand among your neighbours.", inline=False)
     embed.add_field(name="!choose [flame|ash|echo]", value="Choose your path at level 20.", inline=False)
     embed.add_field(name="!realmpath", value="View your current path and next lore milestone.", inline=False)
     embed.add_field(name="!resetpath", value="Abandon your current path (once every 24h).", inline=False)
-    embed.set_footer(text="The Realm remembers those who remain.")
+    embed.add_field(name="!realmactivity [1h|24h|7d]", value="See the busiest channels and dwellers.", inline=False)
+    embed.set_footer(text="Every command also works as a /slash command. The Realm remembers those who remain.")
     await ctx.send(embed=embed)
 
-haunted_users = {}
-collected_whispers = {}
-all_whispers = [
-    "🩸 The shadows are softer tonight...",
-    "🩸 I made you a friendship charm. It whispers.",
-    "🩸 Blood tastes different under the moon.",
-    "🩸 I dreamt of you last night. You fell. I caught you. Then dropped you again. 😌",
-    "🩸 If you close your eyes, I'll speak louder."
-]
-
-@bot.command(name="hauntme")
-async def hauntme(ctx):
-    user_id = str(ctx.author.id)
-    if user_id not in haunted_users:
-        haunted_users[user_id] = []
+# Whispers
+# IDs are stable: add new whispers under new IDs and never reuse a retired one.
+# A user's collection is an int bitmask of whisper IDs.
+all_whispers = {
+    0: "🩸 The shadows are softer tonight...",
+    1: "🩸 I made you a friendship charm. It whispers.",
+    2: "🩸 Blood tastes different under the moon.",
+    3: "🩸 I dreamt of you last night. You fell. I caught you. Then dropped you again. 😌",
+    4: "🩸 If you close your eyes, I'll speak louder.",
+}
+WHISPER_MASK = sum(1 << whisper_id for whisper_id in all_whispers)
+
+def mask_ids(mask):
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return ids
+
+class WhisperStore:
+    # Haunting state per (guild_id, user_id): {"haunted": bool, "mask": int, "heard": int,
+    # "next_haunt": float}, persisted alongside the user table and flushed with it.
+    def __init__(self, backend):
+        self.backend = backend
+        self.users = {}
+        self.dirty = set()
+        self.loaded = False
+
+    def load(self):
+        rows = self.backend.load_whispers(*owned_shard_filter())
+        self.users = {
+            (guild_id, user_id): {
+                "haunted": bool(haunted),
+                "mask": mask,
+                "heard": heard,
+                "next_haunt": next_haunt,
+            }
+            for guild_id, user_id, haunted, mask, heard, next_haunt in rows
+        }
+        self.dirty.clear()
+        self.loaded = True
+
+    def claim_legacy(self, guild_id):
+        # Same rules as UserStore.claim_legacy
+        guild_id = str(guild_id)
+        legacy = [key for key in self.users if key[0] == LEGACY_GUILD_ID]
+        for key in legacy:
+            state = self.users.pop(key)
+            self.dirty.discard(key)
+            if (guild_id, key[1]) not in self.users:
+                self.users[(guild_id, key[1])] = state
+                self.dirty.add((guild_id, key[1]))
+        return len(legacy)
+
+    def get(self, guild_id, user_id):
+        return self.users.get((str(guild_id), str(user_id)))
+
+    def get_or_create(self, guild_id, user_id):
+        key = (str(guild_id), str(user_id))
+        state = self.users.get(key)
+        if state is None:
+            state = self.users[key] = {"haunted": False, "mask": 0, "heard": 0, "next_haunt": None}
+        return state
+
+    def is_haunted(self, guild_id, user_id):
+        state = self.get(guild_id, user_id)
+        return state is not None and state["haunted"]
+
+    def set_haunted(self, guild_id, user_id, haunted):
+        self.get_or_create(guild_id, user_id)["haunted"] = haunted
+        self.dirty.add((str(guild_id), str(user_id)))
+
+    def set_next_haunt(self, guild_id, user_id, fire_at):
+        self.get_or_create(guild_id, user_id)["next_haunt"] = fire_at
+        self.dirty.add((str(guild_id), str(user_id)))
+
+    def available(self, guild_id, user_id):
+        state = self.get(guild_id, user_id)
+        return mask_ids(WHISPER_MASK & ~(state["mask"] if state else 0))
+
+    def collect(self, guild_id, user_id, whisper_id):
+        # Returns True when this whisper completes the collection
+        state = self.get_or_create(guild_id, user_id)
+        had_all = state["mask"] & WHISPER_MASK == WHISPER_MASK
+        state["mask"] |= 1 << whisper_id
+        state["heard"] += 1
+        self.dirty.add((str(guild_id), str(user_id)))
+        return not had_all and state["mask"] & WHISPER_MASK == WHISPER_MASK
+
+    def collected(self, guild_id, user_id):
+        state = self.get(guild_id, user_id)
+        return (state["mask"] & WHISPER_MASK).bit_count() if state else 0
+
+    def heard(self, guild_id, user_id):
+        state = self.get(guild_id, user_id)
+        return state["heard"] if state else 0
+
+    def _take_dirty(self):
+        batch = []
+        for guild_id, user_id in self.dirty:
+            state = self.users[(guild_id, user_id)]
+            batch.append((guild_id, user_id, int(state["haunted"]), state["mask"], state["heard"], state["next_haunt"]))
+        self.dirty.clear()
+        return batch
+
+    async def flush_async(self):
+        if not self.loaded or not self.dirty:
+            return 0
+        batch = self._take_dirty()
         try:
-            await ctx.author.send("🩸 You've invited BloodBun into your DMs... Sweet dreams.")
-        except discord.Forbidden:
-            await ctx.send("🩸 Your DMs are locked... BloodBun will haunt you here instead.")
-    else:
+            await asyncio.to_thread(self.backend.write_whispers, batch)
+        except STORAGE_ERRORS as e:
+            self.dirty.update(row[:2] for row in batch)
+            print(f"Error flushing whisper data: {e}")
+            return 0
+        return len(batch)
+
+whisper_store = WhisperStore(state_backend)
+
+# Haunting scheduler
+# One heap of (fire_at, guild_id, user_id) drives every haunted user's DMs from a
+# single task. Entries are invalidated lazily: an entry only fires if it still
+# matches the stored next_haunt. DMs are paced by a global token bucket.
+HAUNT_MIN_INTERVAL = 6 * 3600  # seconds
+HAUNT_MAX_INTERVAL = 18 * 3600
+HAUNT_RETRY_DELAY = 600
+cooldown_service.add_policy("dm", TokenBucket(5, 1.0))
+cooldown_service.add_policy("dm_user", FixedWindow(1, 5))
+
+class HauntScheduler:
+    def __init__(self):
+        self.heap = []
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def next_delay(self):
+        return random.uniform(HAUNT_MIN_INTERVAL, HAUNT_MAX_INTERVAL)
+
+    def schedule(self, guild_id, user_id, fire_at=None):
+        entry = (time.time() + self.next_delay() if fire_at is None else fire_at, str(guild_id), str(user_id))
+        whisper_store.set_next_haunt(guild_id, user_id, entry[0])
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] == entry:
+            self.wakeup.set()
+
+    def cancel(self, guild_id, user_id):
+        whisper_store.set_next_haunt(guild_id, user_id, None)
+
+    def restore(self):
+        self.heap = []
+        for (guild_id, user_id), state in whisper_store.users.items():
+            if not state["haunted"]:
+                continue
+            if state["next_haunt"] is None:
+                state["next_haunt"] = time.time() + self.next_delay()
+                whisper_store.dirty.add((guild_id, user_id))
+            self.heap.append((state["next_haunt"], guild_id, user_id))
+        heapq.heapify(self.heap)
+        self.wakeup.set()
+
+    def start(self):
+        self.restore()
+        self.task = spawn(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def _is_live(self, entry):
+        state = whisper_store.get(entry[1], entry[2])
+        return state is not None and state["haunted"] and state["next_haunt"] == entry[0]
+
+    async def run(self):
+        await bot.wait_until_ready()
+        while True:
+            while self.heap and not self._is_live(self.heap[0]):
+                heapq.heappop(self.heap)
+            self.wakeup.clear()
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, guild_id, user_id = heapq.heappop(self.heap)
+            try:
+                await self.deliver(guild_id, user_id)
+            except Exception as e:
+                print(f"Error haunting {user_id}: {e!r}")
+                self.schedule(guild_id, user_id, time.time() + HAUNT_RETRY_DELAY)
+
+    async def deliver(self, guild_id, user_id):
+        # DM pacing is per person across guilds and per bot across processes, so it is
+        # counted by the state backend
+        if await state_backend.hit("dm_user", user_id):
+            self.schedule(guild_id, user_id, time.time() + HAUNT_RETRY_DELAY)
+            return
+        await state_backend.acquire("dm", "global")
         try:
-            await ctx.author.send("🩸 You are already haunted.")
-        except discord.Forbidden:
-            await ctx.send("🩸 You are already haunted.")
+            user = bot.get_user(int(user_id)) or await bot.fetch_user(int(user_id))
+        except discord.NotFound:
+            whisper_store.set_haunted(guild_id, user_id, False)
+            self.cancel(guild_id, user_id)
+            return
 
-@bot.command(name="unhauntme")
-async def unhauntme(ctx):
-    user_id = str(ctx.author.id)
-    if user_id in haunted_users:
-        del haunted_users[user_id]
+        available = whisper_store.available(guild_id, user_id)
+        whisper_id = random.choice(available or list(all_whispers))
         try:
-            await ctx.author.send("🩸 You've pulled the covers up... for now.")
+            await user.send(all_whispers[whisper_id])
         except discord.Forbidden:
-            await ctx.send("🩸 You've pulled the covers up... for now.")
+            # Closed DMs: stop haunting instead of retrying forever
+            whisper_store.set_haunted(guild_id, user_id, False)
+            self.cancel(guild_id, user_id)
+            metrics.inc("bloodbun_haunts_total", outcome="forbidden")
+            return
+        except discord.HTTPException:
+            metrics.inc("bloodbun_haunts_total", outcome="error")
+            self.schedule(guild_id, user_id, time.time() + HAUNT_RETRY_DELAY)
+            return
+
+        metrics.inc("bloodbun_haunts_total", outcome="sent")
+        if whisper_store.collect(guild_id, user_id, whisper_id):
+            await award_collector(guild_id, user_id)
+        self.schedule(guild_id, user_id)
+
+haunt_scheduler = HauntScheduler()
+
+async def award_collector(guild_id, user_id):
+    guild = bot.get_guild(int(guild_id))
+    member = get_member(guild, user_id) if guild else None
+    role = role_registry.get(guild, COLLECTOR_ROLE) if guild else None
+    if member is None or role is None or member.get_role(role.id) is not None:
+        return
+    try:
+        await member.add_roles(role)
+    except discord.HTTPException as e:
+        print(f"Error awarding Collector role: {e}")
+
+@bot.hybrid_command(name="hauntme", description="Invite BloodBun into your DMs.")
+@commands.guild_only()
+async def hauntme(ctx):
+    if not whisper_store.is_haunted(ctx.guild.id, ctx.author.id):
+        whisper_store.set_haunted(ctx.guild.id, ctx.author.id, True)
+        haunt_scheduler.schedule(ctx.guild.id, ctx.author.id)
+        await reply_privately(ctx, "🩸 You've invited BloodBun into your DMs... Sweet dreams.",
+                              "🩸 Your DMs are locked... BloodBun will haunt you here instead.")
     else:
-        try:
-            await ctx.author.send("🩸 You were never haunted to begin with. Curious.")
-        except discord.Forbidden:
-            await ctx.send("🩸 You were never haunted to begin with. Curious.")
+        await reply_privately(ctx, "🩸 You are already haunted.")
+
+@bot.hybrid_command(name="unhauntme", description="Stop BloodBun's haunting.")
+@commands.guild_only()
+async def unhauntme(ctx):
+    if whisper_store.is_haunted(ctx.guild.id, ctx.author.id):
+        whisper_store.set_haunted(ctx.guild.id, ctx.author.id, False)
+        haunt_scheduler.cancel(ctx.guild.id, ctx.author.id)
+        await reply_privately(ctx, "🩸 You've pulled the covers up... for now.")
+    else:
+        await reply_privately(ctx, "🩸 You were never haunted to begin with. Curious.")
 
-@bot.command(name="bloodwhisper")
+@bot.hybrid_command(name="bloodwhisper", description="Hear one of BloodBun's whispers.")
+@commands.guild_only()
+@per_user_lock
 async def bloodwhisper(ctx):
-    user_id = str(ctx.author.id)
-    if user_id not in haunted_users:
-        await ctx.send("🩸 You must use `!hauntme` to hear the whispers...")
+    if not whisper_store.is_haunted(ctx.guild.id, ctx.author.id):
+        await ctx.send("🩸 You must use `!hauntme` to hear the whispers...", ephemeral=True)
         return
 
-    available = [w for w in all_whispers if w not in haunted_users[user_id]]
+    available = whisper_store.available(ctx.guild.id, ctx.author.id)
     if not available:
-        await ctx.send("🩸 You've heard all there is to hear... for now.")
+        await ctx.send("🩸 You've heard all there is to hear... for now.", ephemeral=True)
         return
 
-    whisper = random.choice(available)
-    haunted_users[user_id].append(whisper)
+    whisper_id = random.choice(available)
+    whisper = all_whispers[whisper_id]
+    completed = whisper_store.collect(ctx.guild.id, ctx.author.id, whisper_id)
 
-    try:
-        async with ctx.channel.typing():
-            await ctx.author.send(whisper)
-    except discord.Forbidden:
-        await ctx.send(f"🩸 *whispers in the shadows:* {whisper}")
+    if ctx.interaction is not None:
+        await ctx.send(whisper, ephemeral=True)
+    else:
+        try:
+            async with ctx.channel.typing():
+                await ctx.author.send(whisper)
+        except discord.Forbidden:
+            await ctx.send(f"🩸 *whispers in the shadows:* {whisper}")
 
-    if len(haunted_users[user_id]) == len(all_whispers):
+    if completed:
         try:
-            role = discord.utils.get(ctx.guild.roles, name="🐰Collector")
+            role = role_registry.get(ctx.guild, COLLECTOR_ROLE)
             if role:
-                member = ctx.guild.get_member(ctx.author.id)
-                if member:
-                    await member.add_roles(role)
-                    await ctx.send(f"✨🩸🐰 {ctx.author.mention} has unlocked all of BloodBun's whispers and become a 🐰Collector!")
+                await ctx.author.add_roles(role)
+                await ctx.send(f"✨🩸🐰 {ctx.author.mention} has unlocked all of BloodBun's whispers and become a 🐰Collector!")
         except Exception as e:
             print(f"Error awarding Collector role: {e}")
 
-@bot.command(name="hauntstats")
+@bot.hybrid_command(name="hauntstats", description="See how many whispers you've collected.")
+@commands.guild_only()
 async def hauntstats(ctx):
-    user_id = str(ctx.author.id)
-    count = len(haunted_users.get(user_id, []))
-    await ctx.send(f"🩸 You've collected {count}/{len(all_whispers)} whispers.")
+    count = whisper_store.collected(ctx.guild.id, ctx.author.id)
+    await ctx.send(f"🩸 You've collected {count}/{len(all_whispers)} whispers.", ephemeral=True)
 
-@bot.command(name="bloodstats")
+@bot.hybrid_command(name="bloodstats", description="See how often BloodBun has whispered to you.")
+@commands.guild_only()
 async def bloodstats(ctx):
-    user_id = str(ctx.author.id)
-    count = len(haunted_users.get(user_id, []))
-    await ctx.send(f"🩸 BloodBun has whispered to you {count} time(s).")
+    count = whisper_store.heard(ctx.guild.id, ctx.author.id)
+    await ctx.send(f"🩸 BloodBun has whispered to you {count} time(s).", ephemeral=True)
 
-@bot.command()
+@bot.hybrid_command(description="Say hello to BloodBun.")
 async def hello(ctx):
     await ctx.send("👋 BloodBun peeks out from the shadows... Hello, squishy.")
 
-@bot.command()
+@bot.hybrid_command(description="See what BloodBun is snacking on.")
 async def snack(ctx):
     snacks = [
         "🩸 BloodBun is nibbling on a shadowberry tart...",
@@ -382,7 +2581,7 @@ async def snack(ctx):
     ]
     await ctx.send(random.choice(snacks))
 
-@bot.command()
+@bot.hybrid_command(description="Cuddle BloodBun. At your own risk.")
 async def cuddle(ctx):
     cuddles = [
         "🧸 BloodBun flops into your lap. Accept the fluff.",
@@ -392,7 +2591,7 @@ async def cuddle(ctx):
     ]
     await ctx.send(random.choice(cuddles))
 
-@bot.command(name="summonbun")
+@bot.hybrid_command(name="summonbun", description="Learn about BloodBun and his commands.")
 async def summonbun(ctx):
     intro = (
         "🧸✨ **About BloodBun** ✨🩸\n"
@@ -401,13 +2600,13 @@ async def summonbun(ctx):
         "**Commands you can try:**\n"
         "`!hauntme`, `!bloodwhisper`, `!hauntstats`, `!bloodstats`, `!unhauntme`\n"
         "`!snack`, `!cuddle`, `!hello`, `!lore`, `!summonbun`\n"
-        "`!stats`, `!choose`, `!realmpath`, `!resetpath`, `!leaderboard`, `!realmhelp`\n\n"
+        "`!stats`, `!choose`, `!realmpath`, `!resetpath`, `!leaderboard`, `!rank`, `!realmactivity`, `!realmhelp`\n\n"
         "Collect all whispers and earn the 🐰Collector role.\n"
         "*P.S. I only answer when I'm online. Otherwise? I vanish like socks in the laundry.*"
     )
     await ctx.send(intro)
 
-@bot.command(name="lore")
+@bot.hybrid_command(name="lore", description="Hear a piece of Realm lore.")
 async def lore(ctx):
     lores = [
         "🌙 Vrykolia was born beneath a blood moon, wrapped in stormlight and lavender.",
@@ -428,140 +2627,588 @@ async def lore(ctx):
     ]
     await ctx.send(random.choice(lores))
 
-# QOTD responses
-bloodbun_qotd_responses = {
-    "If BloodBun were a boss fight": "🐰 Phase 1: Cuddle trap. Phase 2: Emotional damage. Final phase: Disappears in a puff of static.",
-    "What's one game you're bad at—but love anyway?": "🎮 All of them. I just press buttons until the controller cries.",
-    "If The Realm was a video game": "🩸 Cozy horror survival with unpredictable fluff mechanics. And bugs. Intentional ones.",
-    "If BloodBun whispered a creepy prophecy": "👁️ \"Your socks know too much. Burn the striped ones first.\"",
-    "You've been marked by The Realm": "✨ Every mirror shows what you *almost* became. Also, your coffee is always slightly cold.",
-    "Describe your soul in three emojis": "🧸🩸🔪",
-    "What's your haunting style": "🕯️ Wisp. I drift through walls and whisper embarrassing memories.",
-    "What book would you haunt": "📖 A cookbook. I like whispering bad substitutions during soufflés.",
-    "You find a cursed journal": "✍️ \"Page intentionally left blank. The screaming starts on page 2.\"",
-    "What snack would instantly restore your HP": "🍓 Shadowberry Pop-Tarts. Cursed but toasty.",
-    "What's your comfort food when the shadows get too loud?": "🍲 Bone broth. No questions.",
-    "What treat would you offer a ghost": "🍪 One (1) perfectly salted cookie. Still warm. Bribes matter."
-}
+# Keyword triggers
+# Every keyword is compiled into one alternation so each message is scanned once.
+TRIGGERS_FILE = "triggers.json"
+DATA_RELOAD_INTERVAL = 30  # seconds
 
-# Stream detection and keyword triggers
+class ReloadableCatalog:
+    # A data file that is reparsed whenever its mtime changes
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+        try:
+            self.load()
+        except (OSError, ValueError, re.error) as e:
+            print(f"Error loading {self.path}: {e}")
+            return False
+        self.mtime = mtime
+        return True
+
+class TriggerEngine(ReloadableCatalog):
+    def __init__(self, path):
+        super().__init__(path)
+        self.pattern = None
+        self.keywords = []
+        self.responses = {}
+        self.chance = 6
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        default_whole_word = data.get("whole_word", False)
+        keywords, responses, parts = [], {}, []
+        for index, (keyword, spec) in enumerate(data.get("triggers", {}).items()):
+            if isinstance(spec, list):
+                spec = {"responses": spec}
+            if not spec.get("responses"):
+                continue
+            body = re.escape(keyword.lower())
+            if spec.get("whole_word", default_whole_word):
+                body = rf"\b{body}\b"
+            parts.append(f"(?P<t{len(keywords)}>{body})")
+            keywords.append(keyword)
+            responses[keyword] = list(spec["responses"])
+
+        self.pattern = re.compile("|".join(parts), re.IGNORECASE) if parts else None
+        self.keywords = keywords
+        self.responses = responses
+        self.chance = max(int(data.get("chance", 6)), 1)
+        cooldown_service.add_policy("trigger", FixedWindow(1, float(data.get("channel_cooldown", 0))))
+
+    def match(self, content):
+        if self.pattern is None:
+            return None
+        found = self.pattern.search(content)
+        return self.keywords[int(found.lastgroup[1:])] if found else None
+
+    def respond(self, message):
+        keyword = self.match(message.content)
+        if keyword is None or random.randint(1, self.chance) != 1:
+            return None
+        if cooldown_service.hit("trigger", message.channel.id):
+            return None
+        return random.choice(self.responses[keyword])
+
+trigger_engine = TriggerEngine(TRIGGERS_FILE)
+
+# QOTD responses
+# Phrases are normalised once and indexed by word, so a prompt is matched by a
+# single walk over its words; the longest fully-present phrase wins, and a
+# reworded prompt can still match when enough of a phrase's words appear.
+# Only content words are indexed and scored: function words like "what" or
+# "would" are shared by most prompts and say nothing about which one it is.
+QOTD_FILE = "qotd.json"
+QOTD_STOPWORDS = frozenset("""
+    a an the and or but if of to in on at for with by from as into about so than then
+    is are was were be been being am do does did have has had will would could should
+    can may might must shall i me my im ive you your youre youve yours we our they their
+    he she it its this that these those there what whats which who whom how why when
+    where one not no all any some just very too up out get got
+""".split())
+
+def normalize_text(text):
+    text = text.lower().replace("’", "'").replace("‘", "'")
+    text = re.sub(r"'", "", text)
+    return re.sub(r"[^\w]+", " ", text).strip()
+
+class QotdMatcher(ReloadableCatalog):
+    def __init__(self, path):
+        super().__init__(path)
+        self.responses = []
+        self.phrases = []  # (normalised phrase, unique content word count)
+        self.index = {}
+        self.fuzzy_threshold = 0.75
+        self.fuzzy_min_words = 3  # content words a phrase needs before it may match fuzzily
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        responses, phrases, index = [], [], {}
+        for key_phrase, response in data.get("responses", {}).items():
+            normalized = normalize_text(key_phrase)
+            if not normalized:
+                continue
+            # A phrase made only of function words is indexed by all of them
+            words = set(normalized.split())
+            words = (words - QOTD_STOPWORDS) or words
+            for word in words:
+                index.setdefault(word, []).append(len(phrases))
+            phrases.append((normalized, len(words)))
+            responses.append(response)
+
+        self.responses, self.phrases, self.index = responses, phrases, index
+        self.fuzzy_threshold = float(data.get("fuzzy_threshold", 0.75))
+        self.fuzzy_min_words = int(data.get("fuzzy_min_words", 3))
+
+    def match(self, content):
+        normalized = normalize_text(content)
+        hits = {}
+        for word in set(normalized.split()):
+            for phrase_id in self.index.get(word, ()):
+                hits[phrase_id] = hits.get(phrase_id, 0) + 1
+        if not hits:
+            return None
+
+        padded = f" {normalized} "
+        best, best_key = None, None
+        for phrase_id, count in hits.items():
+            phrase, size = self.phrases[phrase_id]
+            if count == size and f" {phrase} " in padded:
+                key = (2, size, len(phrase))
+            elif size >= self.fuzzy_min_words and count / size >= self.fuzzy_threshold:
+                key = (1, count / size, size)
+            else:
+                continue
+            if best_key is None or key > best_key:
+                best, best_key = phrase_id, key
+        return self.responses[best] if best is not None else None
+
+qotd_matcher = QotdMatcher(QOTD_FILE)
+
+def reload_data_files():
+    reloaded = []
+    for catalog in (trigger_engine, qotd_matcher):
+        if catalog.reload_if_changed():
+            reloaded.append(catalog.path)
+    return reloaded
+
+@tasks.loop(seconds=DATA_RELOAD_INTERVAL)
+async def watch_data_files():
+    for path in reload_data_files():
+        print(f"🔁 Reloaded {path}")
+
+@bot.hybrid_command(name="reloaddata", description="Reload the lore and data files.")
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def reloaddata(ctx):
+    await ctx.defer()
+    trigger_engine.mtime = qotd_matcher.mtime = None
+    reloaded = reload_data_files()
+    await state_backend.publish({"kind": "reload_data"})
+    await ctx.send(f"🌌 Reloaded: {', '.join(reloaded) if reloaded else 'nothing'}")
+
+# Stream detection
+# The original Realm's IDs; see Guild configuration for how other guilds set theirs
 realm_news_channel_id = 1377172856160649246
 realm_nexus_channel_id = 1378882771061051442
 carl_bot_id = 235148962103951360
 quill_bot_id = 713586207119900693
-last_stream_announcement = 0
 stream_cooldown = 300
+cooldown_service.add_policy("stream", FixedWindow(1, stream_cooldown))
+
+# Message routing
+# Handlers are registered against a channel and/or author (None matches any) and
+# whether they want human or bot messages. Prefix commands skip the handlers and
+# go straight to the command processor.
+class MessageRouter:
+    def __init__(self, bot):
+        self.bot = bot
+        self.routes = {}  # (channel_id, author_id) -> [(handler, humans, bots)]
+
+    def register(self, handler, channel_id=None, author_id=None, humans=True, bots=False):
+        self.routes.setdefault((channel_id, author_id), []).append((handler, humans, bots))
+        return handler
+
+    def unregister(self, handler):
+        for key, handlers in list(self.routes.items()):
+            handlers[:] = [entry for entry in handlers if entry[0] is not handler]
+            if not handlers:
+                del self.routes[key]
+
+    def route(self, channel_id=None, author_id=None, humans=True, bots=False):
+        def decorator(handler):
+            return self.register(handler, channel_id, author_id, humans, bots)
+        return decorator
+
+    def handlers_for(self, message):
+        channel_id, author_id = message.channel.id, message.author.id
+        is_bot = message.author.bot
+        handlers = []
+        for key in ((channel_id, author_id), (channel_id, None), (None, author_id), (None, None)):
+            for handler, humans, bots in self.routes.get(key, ()):
+                if bots if is_bot else humans:
+                    handlers.append(handler)
+        return handlers
+
+    async def dispatch(self, message):
+        # Only known commands skip the handlers; chat like "!!!" or "!lol" is ordinary chat
+        if not message.author.bot and message.content.startswith(self.bot.command_prefix):
+            name = message.content[len(self.bot.command_prefix):].split(maxsplit=1)
+            if name and name[0] in self.bot.all_commands:
+                await self.bot.process_commands(message)
+                return
+
+        handlers = self.handlers_for(message)
+        if len(handlers) == 1:
+            await self.run_handler(handlers[0], message)
+        elif handlers:
+            await asyncio.gather(*(self.run_handler(handler, message) for handler in handlers))
+
+    async def run_handler(self, handler, message):
+        started = time.perf_counter()
+        try:
+            await handler(message)
+        except Exception as e:
+            metrics.inc("bloodbun_handler_errors_total", handler=handler.__name__)
+            print(f"Error in message handler {handler.__name__}: {e!r}")
+        finally:
+            metrics.observe("bloodbun_handler_seconds", time.perf_counter() - started, handler=handler.__name__)
+
+router = MessageRouter(bot)
+
+@router.route()
+async def message_xp(message):
+    if message.guild:
+        remember_member(message.author)
+        accrue_message_xp(message)
+
+@router.route()
+async def keyword_triggers(message):
+    response = trigger_engine.respond(message)
+    if response:
+        metrics.inc("bloodbun_triggers_total", kind="keyword")
+        outbound.send(message.channel, response)
+
+async def stream_start(message):
+    if "has entered The Realm!" not in message.content:
+        return
+    nexus_channel_id = guild_configs.get(message.guild.id, {}).get("nexus_channel_id") if message.guild else None
+    if nexus_channel_id and not cooldown_service.retry_after("stream", nexus_channel_id):
+        stream_start_reactions = [
+            "🩸 *BloodBun perks up.* Vry's back. The shadows are watching.",
+            "👁️ The Realm opens... BloodBun sharpened his fluff for this.",
+            "🧸 Twitching ears detected stream energy. *Cuddly chaos incoming.*",
+            "🎮 Game on. Hope you're not afraid of static... or me.",
+            '🌕 BloodBun whispers: "It begins again... bring snacks."'
+        ]
+        gif_url = "https://media0.giphy.com/media/v1.Y2lkPTc5MGI3NjExYzFrYW5lOWdvcG1xc2g2MTl1aGwxa2Q5aHEzOWR6M3ZwNTU4M2I3ayZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9cw/h8REz6z97lJpSKLYdX/giphy.gif"
+        target_channel = bot.get_channel(nexus_channel_id)
+        if isinstance(target_channel, TextChannel):
+            cooldown_service.hit("stream", nexus_channel_id)
+            metrics.inc("bloodbun_triggers_total", kind="stream")
+            outbound.send(target_channel, random.choice(stream_start_reactions))
+            outbound.send(target_channel, gif_url)
+
+async def qotd_response(message):
+    response = qotd_matcher.match(message.content)
+    metrics.inc("bloodbun_triggers_total", kind="qotd" if response else "qotd_fallback")
+    if response:
+        outbound.send(message.channel, response)
+    else:
+        outbound.react(message, ["🩸", "👁️", "🧸", "🐰", "🐰"])
+
+# Chat activity
+# Message counts per channel and per user, each in two array-backed rings: 60
+# one-minute buckets for the last hour and 168 one-hour buckets for the last week.
+# Buckets are cleared lazily as the rings wrap, so recording a message is two
+# increments, and each tracker keeps at most a fixed number of keys (least
+# recently active dropped first). Counts live in memory and restart from zero.
+ACTIVITY_MAX_CHANNELS = 2_000
+ACTIVITY_MAX_USERS = 10_000
+ACTIVITY_WINDOWS = {"1h": 60, "24h": 24 * 60, "7d": 7 * 24 * 60}  # minutes
+ACTIVITY_TOP = 5
+
+# Chat hype: checked once per channel per minute, when its minute bucket rolls over
+HYPE_WINDOW = 5  # minutes
+HYPE_MIN_MESSAGES = 30
+HYPE_FACTOR = 3.0  # times the channel's average rate over the rest of the hour
+HYPE_ENABLED = os.getenv("BLOODBUN_HYPE", "1").lower() not in ("0", "false", "no")
+cooldown_service.add_policy("hype", FixedWindow(1, 1800))
+
+class ActivityCounter:
+    MINUTES = 60
+    HOURS = 168
+
+    def __init__(self, minute):
+        self.minutes = array("I", bytes(4 * self.MINUTES))
+        self.hours = array("I", bytes(4 * self.HOURS))
+        self.minute = minute  # newest bucket written, in minutes since the epoch
+
+    def add(self, minute):
+        # Returns True when this message opened a new minute
+        rolled = minute > self.minute
+        if rolled:
+            for m in range(max(self.minute + 1, minute - self.MINUTES + 1), minute + 1):
+                self.minutes[m % self.MINUTES] = 0
+            last_hour, hour = self.minute // 60, minute // 60
+            for h in range(max(last_hour + 1, hour - self.HOURS + 1), hour + 1):
+                self.hours[h % self.HOURS] = 0
+            self.minute = minute
+        self.minutes[self.minute % self.MINUTES] += 1
+        self.hours[self.minute // 60 % self.HOURS] += 1
+        return rolled
+
+    def count(self, window, minute):
+        # Messages in the `window` minutes up to and including `minute`; windows over
+        # an hour are counted in whole hours
+        if window <= self.MINUTES:
+            first = max(minute - window + 1, self.minute - self.MINUTES + 1)
+            return sum(self.minutes[m % self.MINUTES] for m in range(first, min(minute, self.minute) + 1))
+        hour, last_hour = minute // 60, min(minute, self.minute) // 60
+        first = max(hour - window // 60 + 1, last_hour - self.HOURS + 1)
+        return sum(self.hours[h % self.HOURS] for h in range(first, last_hour + 1))
+
+class ActivityTracker:
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.counters = OrderedDict()  # (guild_id, id) -> ActivityCounter, least recently active first
+
+    def __len__(self):
+        return len(self.counters)
+
+    def record(self, key, minute):
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = ActivityCounter(minute)
+            if len(self.counters) > self.max_keys:
+                self.counters.popitem(last=False)
+        else:
+            self.counters.move_to_end(key)
+        return counter.add(minute)
+
+    def top(self, guild_id, window, minute, limit=ACTIVITY_TOP):
+        counts = ((counter.count(window, minute), key[1]) for key, counter in self.counters.items() if key[0] == guild_id)
+        return [(key, count) for count, key in heapq.nlargest(limit, counts) if count]
+
+channel_activity = ActivityTracker(ACTIVITY_MAX_CHANNELS)
+user_activity = ActivityTracker(ACTIVITY_MAX_USERS)
+
+def is_hype(counter, minute):
+    # Compares the last HYPE_WINDOW finished minutes against the rest of the hour
+    recent = counter.count(HYPE_WINDOW, minute - 1)
+    if recent < HYPE_MIN_MESSAGES:
+        return False
+    earlier = counter.count(ActivityCounter.MINUTES, minute - 1) - recent
+    baseline = earlier / (ActivityCounter.MINUTES - HYPE_WINDOW) * HYPE_WINDOW
+    return recent >= HYPE_FACTOR * max(baseline, 1)
+
+@router.route()
+async def chat_activity(message):
+    if not message.guild:
+        return
+    minute = int(time.time() // 60)
+    user_activity.record((message.guild.id, message.author.id), minute)
+    key = (message.guild.id, message.channel.id)
+    if channel_activity.record(key, minute) and HYPE_ENABLED and is_hype(channel_activity.counters[key], minute):
+        if not cooldown_service.hit("hype", message.channel.id):
+            hype_reactions = [
+                "🩸 *BloodBun's ears shoot up.* The Realm is LOUD tonight.",
+                "👁️ So much chatter... the shadows are taking notes.",
+                "🧸 Hype levels critical. BloodBun is vibrating in his stitches.",
+                "🌕 The Realm stirs. Something is happening and BloodBun wants in.",
+            ]
+            metrics.inc("bloodbun_triggers_total", kind="hype")
+            outbound.send(message.channel, random.choice(hype_reactions))
+            outbound.react(message, ["🩸", "🔥", "🐰"])
+
+@bot.hybrid_command(name="realmactivity", description="See the busiest channels and dwellers.")
+@commands.guild_only()
+async def realmactivity(ctx, window: str = "24h"):
+    window = window.lower()
+    if window not in ACTIVITY_WINDOWS:
+        await ctx.send(f"📈 Usage: `!realmactivity [{'|'.join(ACTIVITY_WINDOWS)}]`")
+        return
+    minute = int(time.time() // 60)
+    channels = channel_activity.top(ctx.guild.id, ACTIVITY_WINDOWS[window], minute)
+    users = user_activity.top(ctx.guild.id, ACTIVITY_WINDOWS[window], minute)
+    if not channels:
+        await ctx.send(f"📈 The Realm has been silent for the last {window}...")
+        return
 
-@bot.event
+    names = await resolve_member_names(ctx.guild, [str(user_id) for user_id, _ in users])
+    lines = [f"📈 **Realm activity — last {window}**", "**Channels**"]
+    lines += [f"{rank}. <#{channel_id}> — {count} message(s)" for rank, (channel_id, count) in enumerate(channels, 1)]
+    lines.append("**Dwellers**")
+    lines += [
+        f"{rank}. {names.get(str(user_id), f'User {user_id}')} — {count} message(s)"
+        for rank, (user_id, count) in enumerate(users, 1)
+    ]
+    await ctx.send("\n".join(lines))
+
+# State events
+# Sent by other processes over the state backend. Leaderboard indexes and the role
+# registry only hold guilds on this process's shards and are kept current by that
+# guild's own gateway events; what crosses processes are admin actions that reach
+# every partition, and guild config edits.
+def on_state_event(event):
+    kind = event["kind"]
+    if kind == "recompute_levels":
+        apply_pending_xp(announce=False)
+        recompute_levels(user_store, xp_table)
+    elif kind == "reload_data":
+        trigger_engine.mtime = qotd_matcher.mtime = None
+        reload_data_files()
+    elif kind == "guild_config":
+        guild_configs[int(event["guild_id"])] = event["config"]
+        bind_guild_routes()
+
+# Guild configuration
+# Channel and bot IDs per guild, loaded into guild_configs at startup and edited
+# with !realmconfig. The guild that owns realm_news_channel_id is seeded with the
+# original Realm's IDs and inherits progression stored before the split by guild.
+GUILD_CONFIG_FIELDS = dict(zip(("news", "nexus", "streambot", "qotdbot"), GUILD_CONFIG_COLUMNS))
+legacy_guild_config = {
+    "news_channel_id": realm_news_channel_id,
+    "nexus_channel_id": realm_nexus_channel_id,
+    "stream_bot_id": carl_bot_id,
+    "qotd_bot_id": quill_bot_id,
+}
+guild_configs = {}  # guild_id -> {column: id or None}
+
+def bind_guild_routes():
+    # Channel IDs are global, so every guild's routes can share the one router
+    router.unregister(stream_start)
+    router.unregister(qotd_response)
+    for config in guild_configs.values():
+        if config.get("news_channel_id") and config.get("stream_bot_id"):
+            router.register(stream_start, config["news_channel_id"], config["stream_bot_id"], humans=False, bots=True)
+        if config.get("nexus_channel_id") and config.get("qotd_bot_id"):
+            router.register(qotd_response, config["nexus_channel_id"], config["qotd_bot_id"], humans=False, bots=True)
+
+async def save_guild_config(guild_id, config):
+    guild_configs[guild_id] = config
+    bind_guild_routes()
+    await asyncio.to_thread(state_backend.save_guild_config, guild_id, config)
+    await state_backend.publish({"kind": "guild_config", "guild_id": guild_id, "config": config})
+
+async def adopt_legacy_guild(guild):
+    if guild.get_channel(realm_news_channel_id) is None:
+        return
+    if guild.id not in guild_configs:
+        await save_guild_config(guild.id, dict(legacy_guild_config))
+    has_legacy = LEGACY_GUILD_ID in user_store.guilds or any(key[0] == LEGACY_GUILD_ID for key in whisper_store.users)
+    if not has_legacy:
+        return
+    await asyncio.to_thread(state_backend.claim_legacy_rows, guild.id)
+    claimed = user_store.claim_legacy(guild.id) + whisper_store.claim_legacy(guild.id)
+    haunt_scheduler.restore()
+    print(f"📦 Moved {claimed} pre-guild record(s) into {guild.name}")
+
+@bot.hybrid_command(name="realmconfig", description="View or change this server's Realm channels and bots.")
+@commands.guild_only()
+@commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def realmconfig(ctx, field: Optional[str] = None, value: Optional[str] = None):
+    config = guild_configs.get(ctx.guild.id, {})
+    if field is None:
+        lines = ["⚙️ **Realm configuration**"]
+        lines += [f"{name}: {config.get(column) or 'not set'}" for name, column in GUILD_CONFIG_FIELDS.items()]
+        await ctx.send("\n".join(lines))
+        return
 
-async def on_message(message):
-    global last_stream_announcement
+    column = GUILD_CONFIG_FIELDS.get(field.lower())
+    digits = re.sub(r"\D", "", value or "")
+    if column is None or not (digits or (value or "").lower() == "none"):
+        await ctx.send(f"⚙️ Usage: `!realmconfig [{'|'.join(GUILD_CONFIG_FIELDS)}] <id|mention|none>`")
+        return
+    await ctx.defer()
+    config = {**config, column: int(digits) if digits else None}
+    await save_guild_config(ctx.guild.id, config)
+    await ctx.send(f"⚙️ {field.lower()} set to {config[column] or 'not set'}.")
 
+@bot.event
+async def on_message(message):
     if message.author == bot.user:
         return
-   
-    # Keyword triggers
-    if not message.author.bot:
-        lowered = message.content.lower()
-        keyword_responses = {
-            "vampire": [
-                "🧛‍♂️ I once tried being a vampire. Too much cleanup.",
-                "🦇 Fangs are cute. I prefer claws.",
-                "🩸 Vampires bite. I nibble *psychically*."
-            ],
-            "blood": [
-                "🩸 Is it yours? Asking for a ritual.",
-                "🧃 Blood? Juice? Tomato soup? I don't ask anymore.",
-                "🩸 The blood moon likes me. We're pen pals."
-            ],
-            "game": [
-                "🎮 If you lose, I get your snacks.",
-                "🧸 I'm unbeatable at hide-and-squeak.",
-                "🎲 Want to play a game? It only ends when you scream."
-            ],
-            "snack": [
-                "🍪 BloodBun drools slightly. It's fine.",
-                "🩸 I accept offerings in cookie form.",
-                "🥠 This one has a message: *RUN*."
-            ],
-            "cuddle": [
-                "🧸 Snuggle activated. Resistance is... adorable.",
-                "✨ Cuddles increase sanity by 2d4.",
-                "🌙 Cuddle confirmed. Sleep in peace. Maybe."
-            ],
-            "fluff": [
-                "🐰 Fluff is power. And static electricity.",
-                "🩸 Fluffy things bite back.",
-                "👁️ I'm made of 40% fluff, 60% secrets."
-            ]
-        }
+    with metrics.timer("bloodbun_on_message_seconds"):
+        await router.dispatch(message)
+
+# Health server
+# Runs on the bot's own event loop using aiohttp, which discord.py already depends on.
+HEALTH_HOST = "0.0.0.0"
+HEALTH_PORT = int(os.getenv("BLOODBUN_HEALTH_PORT") or os.getenv("PORT", "8080"))
+HEALTH_MAX_LATENCY = 10.0  # seconds
+health_runner = None
+
+def gateway_status():
+    latency = bot.latency
+    if SHARDED:
+        # latency is the average over shards; every shard has to be up
+        sockets_open = bool(bot.shards) and not any(shard.is_closed() for shard in bot.shards.values())
+    else:
+        sockets_open = bot.ws is not None and bot.ws.open
+    connected = (
+        not bot.is_closed()
+        and sockets_open
+        and math.isfinite(latency)
+        and latency < HEALTH_MAX_LATENCY
+    )
+    return connected, latency
+
+async def home(request):
+    return web.Response(text="BloodBun is watching...")
+
+async def healthz(request):
+    connected, latency = gateway_status()
+    return web.json_response({
+        "status": "ok" if connected else "unavailable",
+        "gateway_connected": connected,
+        "latency_ms": round(latency * 1000, 1) if math.isfinite(latency) else None,
+    }, status=200 if connected else 503)
+
+async def readyz(request):
+    ready = bot.is_ready() and user_store.loaded
+    return web.json_response({
+        "status": "ready" if ready else "starting",
+        "discord_ready": bot.is_ready(),
+        "storage_loaded": user_store.loaded,
+    }, status=200 if ready else 503)
+
+async def metrics_endpoint(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+def create_health_app():
+    app = web.Application()
+    app.router.add_get("/", home)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics_endpoint)
+    return app
+
+async def start_health_server():
+    global health_runner
+    health_runner = web.AppRunner(create_health_app(), access_log=None)
+    await health_runner.setup()
+    try:
+        await web.TCPSite(health_runner, HEALTH_HOST, HEALTH_PORT).start()
+    except OSError as e:
+        # Only the process owning shard 0 must serve health checks; the others
+        # run without them rather than fail startup over a taken port
+        _, shard_ids = owned_shard_filter()
+        if shard_ids is None or 0 in shard_ids:
+            raise
+        print(f"Health server disabled, port {HEALTH_PORT} unavailable: {e}")
+        await health_runner.cleanup()
+        health_runner = None
+
+async def stop_health_server():
+    global health_runner
+    if health_runner is not None:
+        await health_runner.cleanup()
+        health_runner = None
 
-        for keyword, responses in keyword_responses.items():
-            if keyword in lowered:
-                if random.randint(1, 6) == 1:
-                    await message.channel.send(random.choice(responses))
-                    break
-
-    # Stream start detection
-    if (
-        message.channel.id == realm_news_channel_id
-        and message.author.id == carl_bot_id
-        and "has entered The Realm!" in message.content
-    ):
-        now = time.time()
-        if now - last_stream_announcement >= stream_cooldown:
-            stream_start_reactions = [
-                "🩸 *BloodBun perks up.* Vry's back. The shadows are watching.",
-                "👁️ The Realm opens... BloodBun sharpened his fluff for this.",
-                "🧸 Twitching ears detected stream energy. *Cuddly chaos incoming.*",
-                "🎮 Game on. Hope you're not afraid of static... or me.",
-                '🌕 BloodBun whispers: "It begins again... bring snacks."'
-            ]
-            gif_url = "https://media0.giphy.com/media/v1.Y2lkPTc5MGI3NjExYzFrYW5lOWdvcG1xc2g2MTl1aGwxa2Q5aHEzOWR6M3ZwNTU4M2I3ayZlcD12MV9pbnRlcm5hbF9naWZfYnlfaWQmY3Q9cw/h8REz6z97lJpSKLYdX/giphy.gif"
-            target_channel = bot.get_channel(realm_nexus_channel_id)
-            if isinstance(target_channel, TextChannel):
-                last_stream_announcement = now
-                await target_channel.send(random.choice(stream_start_reactions))
-                await target_channel.send(gif_url)
-
-
-    # QOTD detection
-    if message.channel.id == realm_nexus_channel_id and message.author.id == quill_bot_id:
-        matched = False
-        for key_phrase, response in bloodbun_qotd_responses.items():
-            if key_phrase.lower() in message.content.lower():
-                await message.channel.send(response)
-                matched = True
-                break
-        if not matched:
-            reactions = ["🩸", "👁️", "🧸", "🐰", "🐰"]
-            for emoji in reactions:
-                try:
-                    await message.add_reaction(emoji)
-                except discord.HTTPException:
-                    pass  # Could log this if you want to track failed reactions
-                    
-        await bot.process_commands(message)
-# Flask keep-alive server
-app = Flask('')
-
-@app.route('/')
-def home():
-    return "BloodBun is watching..."
-
-def run():
-    serve(app, host='0.0.0.0', port=8080)
-
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
 TOKEN = os.getenv("DISCORD_TOKEN")
 
-if __name__ == "__main__":
-    keep_alive()
+if __name__ == "__main__" and sys.argv[1:2] == ["state-server"]:
+    asyncio.run(run_state_server(STATE_URL))
+elif __name__ == "__main__":
     print("🚀 Starting BloodBun bot...")
 
     if TOKEN:
         bot.run(TOKEN)
     else:
         print("❌ DISCORD_TOKEN is not set. Bot cannot start.")
+    user_store.close()